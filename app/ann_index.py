@@ -0,0 +1,129 @@
+"""
+ANN-индекс по rag_vacancies.embedding: HNSW (m, ef_construction) или IVFFlat (lists по числу строк),
+пересборка через CREATE INDEX CONCURRENTLY без блокировки поиска и записи,
+параметры точности поиска на запрос (hnsw.ef_search, ivfflat.probes, iterative scan для фильтров).
+"""
+import math
+import re
+from typing import Any
+
+import psycopg
+
+from app.config import settings
+from app.db import get_connection
+
+ANN_INDEX_NAME = "rag_vacancies_embedding_idx"
+ANN_INDEX_TYPES = ("hnsw", "ivfflat")
+# Ключ pg_advisory_lock: пересборка индекса выполняется одна
+_ANN_LOCK_KEY = 7303
+
+
+class AnnIndexBusy(RuntimeError):
+    """Индекс уже пересобирается в другом процессе."""
+
+
+def ivfflat_lists_for(rows: int) -> int:
+    """Рекомендация pgvector: rows / 1000 до миллиона строк, sqrt(rows) — больше."""
+    if rows <= 1_000_000:
+        return max(1, rows // 1000)
+    return int(math.sqrt(rows))
+
+
+def ann_settings(
+    ef_search: int | None = None,
+    probes: int | None = None,
+    iterative: bool = False,
+    rows: int = 0,
+) -> tuple[str, tuple[str, ...]]:
+    """
+    SQL и параметры, задающие параметры поиска на текущую транзакцию (set_config(..., true) —
+    аналог SET LOCAL, но с параметрами запроса). Значения — из запроса или из настроек.
+    iterative: поиск с фильтрами — включить iterative scan (pgvector 0.8+), чтобы индекс
+    продолжал обход, пока не наберётся LIMIT строк, прошедших WHERE.
+    rows: сколько строк запрос берёт из индекса (LIMIT или число кандидатов гибридного поиска).
+    HNSW возвращает не больше ef_search строк, поэтому ef_search поднимается до rows.
+    """
+    configs = [
+        ("hnsw.ef_search", str(max(ef_search or settings.ann_hnsw_ef_search, rows))),
+        ("ivfflat.probes", str(probes or settings.ann_ivfflat_probes)),
+    ]
+    if iterative and settings.ann_iterative_scan != "off":
+        configs.append(("hnsw.iterative_scan", settings.ann_iterative_scan))
+        # У IVFFlat есть только relaxed_order
+        configs.append(("ivfflat.iterative_scan", "relaxed_order"))
+    sql = "SELECT " + ", ".join("set_config(%s, %s, true)" for _ in configs)
+    return sql, tuple(value for pair in configs for value in pair)
+
+
+def _index_sql(name: str, index_type: str, params: dict[str, int]) -> str:
+    with_clause = ", ".join(f"{k} = {int(v)}" for k, v in params.items())
+    return (
+        f"CREATE INDEX CONCURRENTLY {name} ON public.rag_vacancies "
+        f"USING {index_type} (embedding vector_cosine_ops) WITH ({with_clause})"
+    )
+
+
+def get_ann_index_info() -> dict[str, Any]:
+    """Текущий индекс (тип и параметры из определения), оценка числа строк и параметры поиска."""
+    with get_connection() as conn:
+        cur = conn.execute(
+            "SELECT indexdef FROM pg_indexes WHERE schemaname = 'public' AND indexname = %s",
+            (ANN_INDEX_NAME,),
+        )
+        row = cur.fetchone()
+        cur = conn.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = 'public.rag_vacancies'::regclass")
+        rows = max(0, cur.fetchone()[0])
+    definition = row[0] if row else None
+    match = re.search(r"USING (\w+)", definition or "")
+    return {
+        "name": ANN_INDEX_NAME,
+        "type": match.group(1) if match else None,
+        "definition": definition,
+        "rows_estimate": rows,
+        "ef_search": settings.ann_hnsw_ef_search,
+        "probes": settings.ann_ivfflat_probes,
+    }
+
+
+def rebuild_ann_index(
+    index_type: str | None = None,
+    m: int | None = None,
+    ef_construction: int | None = None,
+    lists: int | None = None,
+) -> dict[str, Any]:
+    """
+    Пересобрать индекс: новый строится CREATE INDEX CONCURRENTLY рядом со старым
+    (поиск и запись продолжают работать), затем старый удаляется и новый получает его имя.
+    lists для IVFFlat по умолчанию считается по текущему числу строк (ivfflat_lists_for).
+    CONCURRENTLY нельзя выполнять в транзакции, поэтому — отдельное соединение в autocommit.
+    """
+    index_type = index_type or settings.ann_index_type
+    if index_type not in ANN_INDEX_TYPES:
+        raise ValueError(f"Unknown ANN index type: {index_type}")
+    new_name = f"{ANN_INDEX_NAME}_new"
+
+    with psycopg.connect(settings.database_url, autocommit=True) as conn:
+        cur = conn.execute("SELECT pg_try_advisory_lock(%s)", (_ANN_LOCK_KEY,))
+        if not cur.fetchone()[0]:
+            raise AnnIndexBusy("ANN index rebuild is already running")
+        try:
+            cur = conn.execute("SELECT COUNT(*) FROM public.rag_vacancies WHERE embedding IS NOT NULL")
+            rows = cur.fetchone()[0]
+            if index_type == "hnsw":
+                params = {
+                    "m": m or settings.ann_hnsw_m,
+                    "ef_construction": ef_construction or settings.ann_hnsw_ef_construction,
+                }
+            else:
+                params = {"lists": lists or settings.ann_ivfflat_lists or ivfflat_lists_for(rows)}
+
+            conn.execute("SELECT set_config('maintenance_work_mem', %s, false)", (settings.ann_maintenance_work_mem,))
+            # Недостроенный индекс после прерванной пересборки (INVALID) — удалить
+            conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS public.{new_name}")
+            conn.execute(_index_sql(new_name, index_type, params))
+            conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS public.{ANN_INDEX_NAME}")
+            conn.execute(f"ALTER INDEX public.{new_name} RENAME TO {ANN_INDEX_NAME}")
+            conn.execute("ANALYZE public.rag_vacancies")
+        finally:
+            conn.execute("SELECT pg_advisory_unlock(%s)", (_ANN_LOCK_KEY,))
+    return {"name": ANN_INDEX_NAME, "type": index_type, "params": params, "rows": rows}
@@ -0,0 +1,217 @@
+"""
+Кэш поиска: эмбеддинги запросов (LRU с бюджетом по байтам) и результаты search_similar (TTL).
+Результаты инвалидируются при записи в rag_vacancies (process_raw_to_rag → invalidate_search_cache).
+Опционально — общий бэкенд Redis (CACHE_REDIS_URL), чтобы кэш делили все воркеры uvicorn.
+"""
+import hashlib
+import json
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any
+
+from app.config import settings
+
+
+def normalize_query(query: str) -> str:
+    """Нормализация текста запроса для ключа кэша: lowercase + схлопывание пробелов."""
+    return " ".join(query.lower().split())
+
+
+def _digest(value: str) -> str:
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()
+
+
+class EmbeddingLRU:
+    """LRU «нормализованный запрос → вектор» с ограничением по суммарному размеру векторов в байтах."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._data: OrderedDict[str, array] = OrderedDict()
+
+    def get(self, key: str) -> list[float] | None:
+        vec = self._data.get(key)
+        if vec is None:
+            return None
+        self._data.move_to_end(key)
+        return vec.tolist()
+
+    def set(self, key: str, vec: list[float]) -> None:
+        packed = array("f", vec)
+        size = packed.itemsize * len(packed)
+        if size > self.max_bytes:
+            return
+        old = self._data.pop(key, None)
+        if old is not None:
+            self.bytes -= old.itemsize * len(old)
+        self._data[key] = packed
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _key, evicted = self._data.popitem(last=False)
+            self.bytes -= evicted.itemsize * len(evicted)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class ResultTTLCache:
+    """
+    Результаты поиска с TTL; записи прошлых поколений (до инвалидации) считаются промахом.
+    invalidate вызывается из потока ингеста, get/set — из event loop, поэтому — под блокировкой.
+    """
+
+    def __init__(self, ttl_sec: float, max_entries: int) -> None:
+        self.ttl_sec = ttl_sec
+        self.max_entries = max_entries
+        self.generation = 0
+        self._data: OrderedDict[str, tuple[float, int, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any | None:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, generation, value = entry
+            if generation != self.generation or expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, generation: int) -> None:
+        """generation — поколение на момент начала поиска: если с тех пор был сброс, результат устарел."""
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._data[key] = (time.monotonic() + self.ttl_sec, self.generation, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SearchCache:
+    """
+    Двухуровневый кэш перед search_similar.
+    Уровень 1: эмбеддинг запроса — локальный LRU (+ Redis, если задан CACHE_REDIS_URL).
+    Уровень 2: результаты (запрос + limit + параметры поиска) — с TTL; локально или в Redis.
+    В Redis результаты хранятся под ключом с номером поколения, инвалидация — INCR поколения.
+    """
+
+    def __init__(self) -> None:
+        self.embeddings = EmbeddingLRU(settings.cache_embedding_max_bytes)
+        self.results = ResultTTLCache(settings.cache_result_ttl_sec, settings.cache_result_max_entries)
+        # Векторы разных моделей и бэкендов (torch / onnx / int8) в общем Redis не смешиваются
+        model_id = f"{settings.embedding_model}|{settings.embedding_backend}|{settings.embedding_onnx_quantization}"
+        self.prefix = f"rag-hh:{_digest(model_id)[:8]}"
+        self.counters = {
+            "embedding_hits": 0,
+            "embedding_misses": 0,
+            "result_hits": 0,
+            "result_misses": 0,
+            "invalidations": 0,
+        }
+        self._redis = None
+
+    def _shared(self):
+        """Асинхронный клиент Redis (redis.asyncio) или None, если общий бэкенд не настроен."""
+        if not settings.cache_redis_url:
+            return None
+        if self._redis is None:
+            import redis.asyncio as redis_async
+
+            self._redis = redis_async.from_url(settings.cache_redis_url)
+        return self._redis
+
+    @staticmethod
+    def result_key(query: str, limit: int, **params: Any) -> str:
+        raw = json.dumps([normalize_query(query), limit, params], sort_keys=True, default=str, ensure_ascii=False)
+        return _digest(raw)
+
+    async def get_embedding(self, query: str) -> list[float] | None:
+        key = normalize_query(query)
+        vec = self.embeddings.get(key)
+        if vec is None and (shared := self._shared()) is not None:
+            data = await shared.get(f"{self.prefix}:emb:{_digest(key)}")
+            if data is not None:
+                vec = array("f", data).tolist()
+                self.embeddings.set(key, vec)
+        self.counters["embedding_hits" if vec is not None else "embedding_misses"] += 1
+        return vec
+
+    async def set_embedding(self, query: str, vec: list[float]) -> None:
+        key = normalize_query(query)
+        self.embeddings.set(key, vec)
+        if (shared := self._shared()) is not None:
+            await shared.set(f"{self.prefix}:emb:{_digest(key)}", array("f", vec).tobytes())
+
+    async def _shared_generation(self, shared) -> str:
+        return (await shared.get(f"{self.prefix}:gen") or b"0").decode()
+
+    async def get_results(self, key: str) -> tuple[list[dict[str, Any]] | None, Any]:
+        """
+        Результаты из кэша и поколение кэша на момент чтения. Поколение передаётся в set_results:
+        если ингест сбросил кэш, пока шёл поиск, результат не сохраняется.
+        """
+        if (shared := self._shared()) is not None:
+            generation: Any = await self._shared_generation(shared)
+            data = await shared.get(f"{self.prefix}:res:{generation}:{key}")
+            value = json.loads(data) if data is not None else None
+        else:
+            generation = self.results.generation
+            value = self.results.get(key)
+        self.counters["result_hits" if value is not None else "result_misses"] += 1
+        return value, generation
+
+    async def set_results(self, key: str, value: list[dict[str, Any]], generation: Any) -> None:
+        if (shared := self._shared()) is not None:
+            # Ключ — с поколением на момент чтения: после INCR такие записи уже никто не читает
+            await shared.set(
+                f"{self.prefix}:res:{generation}:{key}",
+                json.dumps(value, ensure_ascii=False, default=str),
+                ex=max(1, int(settings.cache_result_ttl_sec)),
+            )
+        else:
+            self.results.set(key, value, generation)
+
+    def invalidate_results(self) -> None:
+        """Сбросить кэш результатов (вызывается синхронно из ингеста после записи в rag_vacancies)."""
+        self.results.invalidate()
+        self.counters["invalidations"] += 1
+        if settings.cache_redis_url:
+            import redis
+
+            client = redis.from_url(settings.cache_redis_url)
+            try:
+                client.incr(f"{self.prefix}:gen")
+            finally:
+                client.close()
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            **self.counters,
+            "backend": "redis" if settings.cache_redis_url else "local",
+            "embedding_entries": len(self.embeddings),
+            "embedding_bytes": self.embeddings.bytes,
+            "result_entries": len(self.results),
+        }
+
+
+@lru_cache(maxsize=1)
+def get_search_cache() -> SearchCache:
+    return SearchCache()
+
+
+def invalidate_search_cache() -> None:
+    get_search_cache().invalidate_results()
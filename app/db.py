@@ -1,33 +1,173 @@
-import json
-from contextlib import contextmanager
-from typing import Iterator
+"""
+Подключение к PostgreSQL через общий пул соединений (psycopg_pool).
+Тип vector (pgvector) регистрируется один раз на каждое соединение пула.
+Синхронный пул — для ингеста и служебных эндпоинтов, асинхронный — для /search и /rag.
+"""
+import asyncio
+import queue
+import threading
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Iterator
 
 import psycopg
-from pgvector.psycopg import register_vector
+from pgvector.psycopg import register_vector, register_vector_async
+from psycopg_pool import AsyncConnectionPool, ConnectionPool
 
 from app.config import settings
 
 
-@contextmanager
-def get_connection():
-    conn = psycopg.connect(settings.database_url)
+def _configure_connection(conn: psycopg.Connection) -> None:
+    """Вызывается пулом для каждого нового соединения: регистрация типа vector."""
     register_vector(conn)
-    try:
+    # configure должен вернуть соединение в состоянии idle (без открытой транзакции)
+    conn.commit()
+
+
+_pool: ConnectionPool | None = None
+# Без блокировки потоки, первыми обратившиеся к пулу одновременно, открыли бы по пулу каждый
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Пул соединений на процесс (создаётся при первом обращении)."""
+    global _pool
+    if _pool is not None:
+        return _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                settings.database_url,
+                min_size=settings.db_pool_min_size,
+                max_size=settings.db_pool_max_size,
+                timeout=settings.db_pool_timeout,
+                max_idle=settings.db_pool_max_idle,
+                configure=_configure_connection,
+                check=ConnectionPool.check_connection if settings.db_pool_check else None,
+                name="rag-hh",
+                open=True,
+            )
+    return _pool
+
+
+def close_pool() -> None:
+    """Закрыть пул (при остановке приложения)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+async def _configure_async_connection(conn: psycopg.AsyncConnection) -> None:
+    await register_vector_async(conn)
+    await conn.commit()
+
+
+_async_pool: AsyncConnectionPool | None = None
+# Создание пула ждёт pool.open(): без блокировки первые параллельные запросы открыли бы по пулу каждый
+_async_pool_lock = asyncio.Lock()
+
+
+async def get_async_pool() -> AsyncConnectionPool:
+    """Асинхронный пул на процесс; создаётся и открывается внутри работающего event loop."""
+    global _async_pool
+    if _async_pool is not None:
+        return _async_pool
+    async with _async_pool_lock:
+        if _async_pool is None:
+            pool = AsyncConnectionPool(
+                settings.database_url,
+                min_size=settings.db_pool_min_size,
+                max_size=settings.db_pool_max_size,
+                timeout=settings.db_pool_timeout,
+                max_idle=settings.db_pool_max_idle,
+                configure=_configure_async_connection,
+                check=AsyncConnectionPool.check_connection if settings.db_pool_check else None,
+                name="rag-hh-async",
+                open=False,
+            )
+            await pool.open()
+            _async_pool = pool
+    return _async_pool
+
+
+async def close_async_pool() -> None:
+    global _async_pool
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
+
+
+@asynccontextmanager
+async def get_async_connection() -> AsyncIterator[psycopg.AsyncConnection]:
+    """Асинхронный аналог get_connection()."""
+    pool = await get_async_pool()
+    async with pool.connection() as conn:
         yield conn
-        conn.commit()
-    except Exception:
-        conn.rollback()
-        raise
-    finally:
-        conn.close()
 
 
-def get_connection_sync():
-    conn = psycopg.connect(settings.database_url)
-    register_vector(conn)
-    return conn
+@contextmanager
+def get_connection() -> Iterator[psycopg.Connection]:
+    """
+    Соединение из пула. При выходе без ошибки — commit, при исключении — rollback;
+    затем соединение возвращается в пул.
+    """
+    with get_pool().connection() as conn:
+        yield conn
 
 
-def list_to_pgvector(vec: list[float]) -> str:
-    """Формат для передачи в SQL: '[0.1, 0.2, ...]'"""
-    return json.dumps(vec)
+_STREAM_END = object()
+
+
+def stream_query(
+    query: str,
+    params: tuple[Any, ...] | None = None,
+    page_size: int = 500,
+    prefetch: int = 2,
+) -> Iterator[list[tuple[Any, ...]]]:
+    """
+    Потоковое чтение большого результата страницами по page_size строк через именованный
+    (server-side) курсор — в памяти не больше prefetch + 1 страниц, независимо от размера таблицы.
+    Чтение идёт в отдельном потоке на своём соединении из пула, поэтому следующая страница
+    читается, пока вызывающий код обрабатывает текущую (эмбеддинги, запись, commit на другом соединении).
+    """
+    pages: queue.Queue = queue.Queue(maxsize=max(1, prefetch))
+    stop = threading.Event()
+
+    def put(item: Any) -> None:
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def reader() -> None:
+        try:
+            with get_connection() as conn:
+                with conn.cursor(name=f"stream_{uuid.uuid4().hex[:12]}") as cur:
+                    cur.itersize = page_size
+                    cur.execute(query, params)
+                    while not stop.is_set():
+                        rows = cur.fetchmany(page_size)
+                        if not rows:
+                            break
+                        put(rows)
+            put(_STREAM_END)
+        except BaseException as e:
+            put(e)
+
+    thread = threading.Thread(target=reader, name="db-stream", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = pages.get()
+            if item is _STREAM_END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
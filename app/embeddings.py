@@ -1,31 +1,343 @@
 """
 Эмбеддинги через sentence-transformers (локально, поддерживает русский).
 Размерность модели paraphrase-multilingual-MiniLM-L12-v2 — 384.
+Бэкенд выбирается в настройках: torch (по умолчанию) или onnx — ONNX Runtime, опционально
+с динамической int8-квантизацией (EMBEDDING_ONNX_QUANTIZATION). Сверка бэкендов —
+scripts/check_embedding_parity.py.
 """
+import asyncio
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
+from pathlib import Path
 from typing import Any
 
+import numpy as np
+import sentence_transformers
 from sentence_transformers import SentenceTransformer
+from transformers import AutoTokenizer
 
 from app.config import settings
 
 
+class EmbeddingOverloaded(RuntimeError):
+    """Очередь на инференс переполнена — запрос нужно отклонить (503), а не ставить в очередь."""
+
+
+EMBEDDING_BACKENDS = ("torch", "onnx")
+# SentenceTransformer(backend="onnx") появился в sentence-transformers 3.2
+ONNX_MIN_VERSION = (3, 2)
+
+
+def _version_tuple(version: str) -> tuple[int, ...]:
+    """'3.2.1' -> (3, 2, 1); суффиксы вроде 'dev0' и 'rc1' отбрасываются."""
+    parts = []
+    for part in version.split(".")[:3]:
+        digits = "".join(itertools.takewhile(str.isdigit, part))
+        if not digits:
+            break
+        parts.append(int(digits))
+    return tuple(parts)
+
+
+def _onnx_model_dir() -> Path:
+    return Path(settings.embedding_onnx_dir) / settings.embedding_model.replace("/", "__")
+
+
+def load_embedding_model(backend: str | None = None, quantization: str | None = None) -> SentenceTransformer:
+    """
+    Загрузить модель с заданным бэкендом (по умолчанию — из настроек).
+    onnx: модель экспортируется в ONNX один раз и сохраняется в EMBEDDING_ONNX_DIR; при
+    quantization (avx2, avx512, avx512_vnni, arm64) рядом сохраняется int8-версия
+    (onnx/model_qint8_<quantization>.onnx). Нужен sentence-transformers[onnx] >= 3.2.
+    """
+    backend = backend or settings.embedding_backend
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+    if backend == "torch":
+        return SentenceTransformer(settings.embedding_model)
+
+    if _version_tuple(sentence_transformers.__version__) < ONNX_MIN_VERSION:
+        raise RuntimeError(
+            f"EMBEDDING_BACKEND=onnx requires sentence-transformers>={'.'.join(map(str, ONNX_MIN_VERSION))}, "
+            f"installed {sentence_transformers.__version__}: pip install 'sentence-transformers[onnx]>=3.2'"
+        )
+    model_dir = _onnx_model_dir()
+    file_name = f"onnx/model_qint8_{quantization}.onnx" if quantization else "onnx/model.onnx"
+    if not (model_dir / file_name).exists():
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+
+        model = SentenceTransformer(settings.embedding_model, backend="onnx")
+        model.save_pretrained(str(model_dir))
+        if quantization:
+            export_dynamic_quantized_onnx_model(model, quantization, str(model_dir))
+    return SentenceTransformer(str(model_dir), backend="onnx", model_kwargs={"file_name": file_name})
+
+
 @lru_cache(maxsize=1)
 def get_embedding_model() -> SentenceTransformer:
-    return SentenceTransformer(settings.embedding_model)
+    backend = settings.embedding_backend
+    return load_embedding_model(backend, settings.embedding_onnx_quantization if backend == "onnx" else None)
+
+
+@lru_cache(maxsize=1)
+def get_embedding_executor() -> ThreadPoolExecutor:
+    """
+    Отдельный пул потоков для инференса модели: encode не занимает общий threadpool
+    FastAPI/anyio, поэтому /health, /stats и т.п. не ждут медленных запросов к модели.
+    """
+    return ThreadPoolExecutor(
+        max_workers=settings.embedding_workers,
+        thread_name_prefix="embedding",
+    )
+
+
+# Модель и её быстрый токенизатор общие для процесса и не потокобезопасны: encode из пула
+# инференса (/search, /rag) и из этапа 2 выполняются по одному. Параллелизм — внутри encode
+# (потоки torch / ONNX Runtime), а не между вызовами
+_encode_lock = threading.Lock()
+
+
+def _encode(texts: str | list[str], **kwargs: Any) -> np.ndarray:
+    model = get_embedding_model()
+    with _encode_lock:
+        return model.encode(texts, convert_to_numpy=True, **kwargs)
 
 
 def embed(text: str) -> list[float]:
     """Один текст -> вектор размерности 384."""
+    return _encode(text).tolist()
+
+
+class EmbeddingBatcher:
+    """
+    Динамический micro-batching запросов к модели.
+    Запросы, пришедшие в течение window_ms (или пока не наберётся max_batch_size),
+    кодируются одним model.encode; каждый вызывающий получает свой вектор через future.
+    Кодирование — в пуле get_embedding_executor(); сами вызовы encode идут по одному (_encode_lock).
+    """
+
+    def __init__(self, max_batch_size: int, window_ms: float, max_queue: int, workers: int) -> None:
+        self.max_batch_size = max(1, max_batch_size)
+        self.window_sec = max(0.0, window_ms) / 1000.0
+        self.max_queue = max_queue
+        self.workers = max(1, workers)
+        self._queue: asyncio.Queue | None = None
+        self._tasks: list[asyncio.Task] = []
+        # Метрики
+        self.batch_size_hist: dict[int, int] = {}
+        self.batches = 0
+        self.items = 0
+        self.wait_sec_total = 0.0
+        self.wait_sec_max = 0.0
+        self.encode_sec_total = 0.0
+        self.rejected = 0
+
+    def _ensure_started(self) -> asyncio.Queue:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        return self._queue
+
+    async def submit(self, text: str) -> list[float]:
+        queue = self._ensure_started()
+        if queue.qsize() >= self.max_queue:
+            self.rejected += 1
+            raise EmbeddingOverloaded("Embedding queue is full")
+        fut = asyncio.get_running_loop().create_future()
+        queue.put_nowait((text, fut, time.perf_counter()))
+        return await fut
+
+    async def submit_many(self, texts: list[str]) -> list[list[float]]:
+        """
+        Несколько текстов в ту же очередь (POST /search/batch): кодируются вместе с одиночными
+        запросами батчами до max_batch_size. Лимит очереди проверяется как в submit.
+        """
+        queue = self._ensure_started()
+        if queue.qsize() >= self.max_queue:
+            self.rejected += 1
+            raise EmbeddingOverloaded("Embedding queue is full")
+        loop = asyncio.get_running_loop()
+        enqueued = time.perf_counter()
+        futures = [loop.create_future() for _ in texts]
+        for text, fut in zip(texts, futures):
+            queue.put_nowait((text, fut, enqueued))
+        return list(await asyncio.gather(*futures))
+
+    async def _collect(self, queue: asyncio.Queue) -> list[tuple[str, asyncio.Future, float]]:
+        batch = [await queue.get()]
+        deadline = time.perf_counter() + self.window_sec
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                # Окно истекло — забрать то, что уже лежит в очереди, без ожидания
+                if queue.empty():
+                    break
+                batch.append(queue.get_nowait())
+                continue
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _worker(self) -> None:
+        queue = self._queue
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect(queue)
+            batch = [item for item in batch if not item[1].cancelled()]
+            if not batch:
+                continue
+            started = time.perf_counter()
+            for _text, _fut, enqueued in batch:
+                wait = started - enqueued
+                self.wait_sec_total += wait
+                self.wait_sec_max = max(self.wait_sec_max, wait)
+            bucket = 1 << (len(batch) - 1).bit_length()
+            self.batch_size_hist[bucket] = self.batch_size_hist.get(bucket, 0) + 1
+            self.batches += 1
+            self.items += len(batch)
+            texts = [text for text, _fut, _t in batch]
+            try:
+                vecs = await loop.run_in_executor(get_embedding_executor(), embed_batch, texts, len(texts))
+            except Exception as e:
+                for _text, fut, _t in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            finally:
+                self.encode_sec_total += time.perf_counter() - started
+            for (_text, fut, _t), vec in zip(batch, vecs):
+                if not fut.done():
+                    fut.set_result(vec)
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "batches": self.batches,
+            "items": self.items,
+            "rejected": self.rejected,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0,
+            # ключ — верхняя граница корзины (1, 2, 4, 8, ...)
+            "batch_size_histogram": dict(sorted(self.batch_size_hist.items())),
+            "avg_wait_ms": round(self.wait_sec_total / self.items * 1000, 3) if self.items else 0,
+            "max_wait_ms": round(self.wait_sec_max * 1000, 3),
+            "avg_encode_ms": round(self.encode_sec_total / self.batches * 1000, 3) if self.batches else 0,
+        }
+
+
+_batcher: EmbeddingBatcher | None = None
+
+
+def get_embedding_batcher() -> EmbeddingBatcher:
+    global _batcher
+    if _batcher is None:
+        _batcher = EmbeddingBatcher(
+            max_batch_size=settings.embedding_batch_max_size,
+            window_ms=settings.embedding_batch_window_ms,
+            max_queue=settings.embedding_queue_max,
+            workers=settings.embedding_workers,
+        )
+    return _batcher
+
+
+async def stop_embedding_batcher() -> None:
+    global _batcher
+    if _batcher is not None:
+        await _batcher.stop()
+        _batcher = None
+
+
+async def embed_async(text: str) -> list[float]:
+    """
+    Асинхронный embed() через micro-batching (EmbeddingBatcher).
+    Если в очереди уже settings.embedding_queue_max запросов — EmbeddingOverloaded.
+    """
+    return await get_embedding_batcher().submit(text)
+
+
+async def embed_batch_async(texts: list[str]) -> list[list[float]]:
+    """
+    Пакет текстов через EmbeddingBatcher (для POST /search/batch): та же очередь и тот же
+    лимит, что у embed_async; при переполнении очереди — EmbeddingOverloaded.
+    """
+    if not texts:
+        return []
+    return await get_embedding_batcher().submit_many(texts)
+
+
+# Токенизаторы для fit_token_budget — по одному на поток (см. _budget_tokenizer)
+_budget_local = threading.local()
+
+
+def _budget_tokenizer() -> Any:
+    """
+    Отдельный экземпляр токенизатора на поток. Быстрый токенизатор HF не потокобезопасен:
+    model.encode переключает на нём truncation/padding, и параллельный вызов из потоков
+    подготовки текстов ломал бы батчи инференса ("Already borrowed", батч без padding).
+    """
+    tokenizer = getattr(_budget_local, "tokenizer", None)
+    if tokenizer is None:
+        tokenizer = AutoTokenizer.from_pretrained(get_embedding_model().tokenizer.name_or_path)
+        _budget_local.tokenizer = tokenizer
+    return tokenizer
+
+
+def fit_token_budget(text: str, max_tokens: int | None = None) -> tuple[str, int]:
+    """
+    Обрезать текст до бюджета токенов модели (по умолчанию max_seq_length без служебных токенов):
+    всё, что дальше, модель всё равно отбросит. Возвращает текст и число токенов в нём.
+    Поля в тексте должны идти по убыванию ценности (см. vacancy_to_text).
+    """
     model = get_embedding_model()
-    vec = model.encode(text, convert_to_numpy=True)
-    return vec.tolist()
+    budget = max_tokens or settings.embedding_max_tokens or model.max_seq_length - 2
+    # Предобрезка по символам (токен в среднем 3-5 символов), чтобы не токенизировать длинный хвост
+    head = text[: budget * 8]
+    offsets = _budget_tokenizer()(head, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+    if len(offsets) <= budget:
+        return head, len(offsets)
+    return head[: offsets[budget - 1][1]], budget
+
+
+def embed_batch_array(
+    texts: list[str],
+    batch_size: int = 32,
+    lengths: list[int] | None = None,
+) -> np.ndarray:
+    """
+    Пакет текстов -> матрица float32 (len(texts), dim); для записи векторов в БД без list/JSON.
+    lengths — длины текстов в токенах (fit_token_budget): тексты группируются в батчи по длине,
+    чтобы не дополнять короткие до самого длинного в батче; порядок результата — как у texts.
+    """
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32)
+    if lengths is None:
+        vecs = _encode(texts, batch_size=batch_size)
+        return vecs.astype(np.float32, copy=False)
+    order = np.argsort(np.asarray(lengths), kind="stable")
+    out: np.ndarray | None = None
+    for start in range(0, len(order), batch_size):
+        idx = order[start : start + batch_size]
+        # Каждый батч — отдельный encode: внутри encode тексты пересортировываются по длине в символах
+        vecs = _encode([texts[i] for i in idx], batch_size=len(idx))
+        if out is None:
+            out = np.empty((len(texts), vecs.shape[1]), dtype=np.float32)
+        out[idx] = vecs
+    return out
 
 
 def embed_batch(texts: list[str], batch_size: int = 32) -> list[list[float]]:
     """Пакет текстов -> список векторов."""
     if not texts:
         return []
-    model = get_embedding_model()
-    vecs = model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
-    return [v.tolist() for v in vecs]
+    return embed_batch_array(texts, batch_size=batch_size).tolist()
@@ -2,10 +2,15 @@
 Клиент API hh.ru для загрузки вакансий.
 Документация: https://dev.hh.ru/
 """
+import asyncio
+import itertools
 import re
 import ssl
 import time
-from typing import Any
+from functools import lru_cache
+from html import unescape
+from html.entities import html5
+from typing import Any, Callable
 
 import httpx
 
@@ -32,6 +37,12 @@ FETCH_DETAIL_TIMEOUT = httpx.Timeout(connect=25.0, read=40.0, write=40.0, pool=1
 PER_PAGE_MAX = 100
 
 
+@lru_cache(maxsize=1)
+def _get_client() -> httpx.Client:
+    """Общий синхронный клиент: keep-alive соединения переиспользуются между запросами (без нового TLS handshake)."""
+    return httpx.Client(timeout=FETCH_DETAIL_TIMEOUT)
+
+
 def fetch_vacancies(
     text: str = "python",
     per_page: int = PER_PAGE_MAX,
@@ -72,6 +83,29 @@ def fetch_vacancies(
     return all_items
 
 
+def fetch_vacancies_page(
+    text: str,
+    page: int,
+    per_page: int = PER_PAGE_MAX,
+    search_field: str = "name",
+) -> tuple[list[dict[str, Any]], int]:
+    """Одна страница поиска GET /vacancies: (items, всего страниц). Для пошаговой выгрузки с чекпоинтами."""
+    r = _get_client().get(
+        f"{API_BASE}/vacancies",
+        params={
+            "text": text,
+            "per_page": per_page,
+            "page": page,
+            "search_field": search_field,
+        },
+        headers=_get_headers(),
+        timeout=30.0,
+    )
+    r.raise_for_status()
+    data = r.json()
+    return data.get("items", []), data.get("pages", 0)
+
+
 def fetch_professional_roles() -> list[dict[str, Any]]:
     """Список профессиональных ролей (категории и роли) с api.hh.ru/professional_roles."""
     with httpx.Client(timeout=30.0) as client:
@@ -122,19 +156,86 @@ def fetch_vacancies_by_role(
     return all_items
 
 
+# Блочные теги (абзацы, списки, переносы, ячейки таблиц) — граница строки; остальные теги — пробел
+_BLOCK_TAGS = ("p", "br", "hr", "li", "ul", "ol", "div", "h1", "h2", "h3", "h4", "h5", "h6", "tr", "td", "th", "table", "blockquote")
+_INLINE_TAGS = ("strong", "b", "em", "i", "u", "s", "span", "a", "sup", "sub", "code")
+
+# Маркер границы строки до нормализации пробелов (в тексте вакансий не встречается)
+_LINE_BREAK = "\x00"
+
+
+def _tag_spellings(name: str) -> set[str]:
+    # короткие имена — во всех сочетаниях регистра (<Br>, <LI>), длинные — строчные, ЗАГЛАВНЫЕ и с Заглавной
+    if len(name) <= 3:
+        return {"".join(chars) for chars in itertools.product(*((c.lower(), c.upper()) for c in name))}
+    return {name, name.upper(), name.title()}
+
+
+# Содержимое тега между < и > -> разделитель. Теги без атрибутов (так размечены описания hh.ru)
+# находятся одним поиском в словаре; остальные разбирает _tag_separator
+_TAG_SEPARATORS = {
+    form: sep
+    for names, sep in ((_BLOCK_TAGS, _LINE_BREAK), (_INLINE_TAGS, " "))
+    for name in names
+    for spelling in _tag_spellings(name)
+    for form in (spelling, "/" + spelling, spelling + "/", spelling + " /")
+}
+_TAG_NAME_RE = re.compile(r"/?([A-Za-z][A-Za-z0-9]*)")
+_TAG_SPLIT_RE = re.compile(r"<([^>]*)>")
+
+# Именованные сущности (&quot; -> "); &nbsp; — сразу пробел, его всё равно схлопнет нормализация
+_ENTITIES = {name[:-1]: char for name, char in html5.items() if name.endswith(";")}
+_ENTITIES["nbsp"] = " "
+
+
+def _tag_separator(body: str) -> str:
+    m = _TAG_NAME_RE.match(body)
+    return _LINE_BREAK if m and m.group(1).lower() in _BLOCK_TAGS else " "
+
+
+def _unescape_entities(text: str) -> str:
+    """Раскодировать сущности вида &name; и &#NNN;: работа пропорциональна числу «&», а не длине текста."""
+    pieces = text.split("&")
+    out = [pieces[0]]
+    for piece in pieces[1:]:
+        name, semicolon, rest = piece.partition(";")
+        char = _ENTITIES.get(name) if semicolon else None
+        if char is None and semicolon and name[:1] == "#":
+            char = unescape(f"&{name};")
+            if char[:1] == "&":
+                char = None
+        out.append(char + rest if char is not None else "&" + piece)
+    return "".join(out)
+
+
 def strip_html(html: str | None) -> str | None:
     """
-    Удаление HTML-тегов из строки (описание вакансии с hh.ru).
-    Возвращает None для пустого ввода, иначе текст без тегов с нормализованными пробелами.
+    Текст описания вакансии (HTML с hh.ru) без тегов: абзацы и пункты списков — отдельные строки,
+    HTML-сущности (&quot;, &nbsp;, ...) раскодированы, пробелы внутри строк нормализованы.
+    Возвращает None для пустого ввода или описания без текста.
     """
     if not html or not html.strip():
         return None
-    text = html
-    for tag in ("<p>", "</p>", "<br>", "<br/>", "<br />", "<ul>", "</ul>", "<li>", "</li>", "<strong>", "</strong>", "<div>", "</div>"):
-        text = text.replace(tag, " ")
-    text = re.sub(r"<[^>]+>", " ", text)
-    text = " ".join(text.split())
-    return text.strip() or None
+    # Скобки сбалансированы и идут по порядку — делим по ним без регулярного выражения:
+    # чётные элементы — текст, нечётные — содержимое тегов
+    if html.count("<") == html.count(">") and html.find(">") > html.find("<"):
+        parts = html.replace(">", "<").split("<")
+    else:
+        parts = _TAG_SPLIT_RE.split(html)
+    try:
+        parts[1::2] = map(_TAG_SEPARATORS.__getitem__, parts[1::2])
+    except KeyError:
+        parts[1::2] = [_TAG_SEPARATORS.get(body) or _tag_separator(body) for body in parts[1::2]]
+    text = "".join(parts)
+    if "&" in text:
+        text = _unescape_entities(text)
+    if "\n" in text or "\r" in text or "\t" in text or "\xa0" in text:
+        # split() без аргументов схлопывает любые пробелы, включая переводы строк исходника
+        text = " ".join(text.split())
+    else:
+        while "  " in text:
+            text = text.replace("  ", " ")
+    return "\n".join(filter(None, map(str.strip, text.split(_LINE_BREAK)))) or None
 
 
 def fetch_vacancy_detail(vacancy_id: str) -> dict[str, Any] | None:
@@ -142,12 +243,11 @@ def fetch_vacancy_detail(vacancy_id: str) -> dict[str, Any] | None:
     last_error: Exception | None = None
     for attempt in range(FETCH_DETAIL_RETRIES):
         try:
-            with httpx.Client(timeout=FETCH_DETAIL_TIMEOUT) as client:
-                r = client.get(f"{API_BASE}/vacancies/{vacancy_id}", headers=_get_headers())
-                if r.status_code == 404:
-                    return None
-                r.raise_for_status()
-                return r.json()
+            r = _get_client().get(f"{API_BASE}/vacancies/{vacancy_id}", headers=_get_headers())
+            if r.status_code == 404:
+                return None
+            r.raise_for_status()
+            return r.json()
         except (httpx.ConnectError, httpx.ReadError, httpx.TimeoutException, OSError, ssl.SSLError) as e:
             last_error = e
             if attempt < FETCH_DETAIL_RETRIES - 1:
@@ -159,12 +259,175 @@ def fetch_vacancy_detail(vacancy_id: str) -> dict[str, Any] | None:
     return None
 
 
-def vacancy_to_text(v: dict[str, Any]) -> str:
-    """Собрать текст вакансии для эмбеддинга: название + описание + требования."""
+class TokenBucket:
+    """
+    Асинхронный token bucket: rate токенов в секунду, запас до capacity.
+    Адаптивный: при 429/403 скорость снижается вдвое и запросы приостанавливаются
+    на Retry-After; после успешных ответов скорость плавно возвращается к базовой.
+    """
+
+    def __init__(self, rate: float, capacity: float, min_rate: float = 0.1) -> None:
+        self.base_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self.tokens) / self.rate)
+
+    def throttled(self, retry_after: float | None) -> None:
+        """Ответ 429/403: снизить скорость и приостановить выдачу токенов."""
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0.0
+        pause = retry_after if retry_after is not None else 1.0 / self.rate
+        self.paused_until = max(self.paused_until, time.monotonic() + pause)
+
+    def succeeded(self) -> None:
+        if self.rate < self.base_rate:
+            self.rate = min(self.base_rate, self.rate * 1.05)
+
+
+def _retry_after_sec(r: httpx.Response) -> float | None:
+    value = r.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+def make_rate_limiter(max_rps: float | None = None) -> TokenBucket:
+    """Token bucket под лимиты hh.ru: отдельные бюджеты для анонимных запросов и OAuth (HH_TOKEN)."""
+    if settings.hh_token:
+        rate, burst = settings.hh_oauth_rps, settings.hh_oauth_burst
+    else:
+        rate, burst = settings.hh_anon_rps, settings.hh_anon_burst
+    if max_rps is not None:
+        rate = min(rate, max_rps)
+    return TokenBucket(rate=rate, capacity=burst)
+
+
+async def _fetch_vacancy_detail_async(
+    client: httpx.AsyncClient,
+    limiter: TokenBucket,
+    vacancy_id: str,
+) -> dict[str, Any] | None:
+    """GET /vacancies/{id} с учётом лимитера; повтор при сетевых сбоях и 429/403 (Retry-After)."""
+    for attempt in range(FETCH_DETAIL_RETRIES):
+        await limiter.acquire()
+        try:
+            r = await client.get(f"{API_BASE}/vacancies/{vacancy_id}")
+        except (httpx.ConnectError, httpx.ReadError, httpx.RemoteProtocolError, httpx.TimeoutException, OSError, ssl.SSLError):
+            if attempt == FETCH_DETAIL_RETRIES - 1:
+                raise
+            await asyncio.sleep(FETCH_DETAIL_RETRY_DELAY_SEC * (attempt + 1))
+            continue
+        if r.status_code == 404:
+            limiter.succeeded()
+            return None
+        if r.status_code in (403, 429):
+            limiter.throttled(_retry_after_sec(r))
+            if attempt == FETCH_DETAIL_RETRIES - 1:
+                r.raise_for_status()
+            continue
+        r.raise_for_status()
+        limiter.succeeded()
+        return r.json()
+    return None
+
+
+async def fetch_vacancy_details_async(
+    vacancy_ids: list[str],
+    on_chunk: Callable[[list[dict[str, Any]]], None],
+    chunk_size: int = 100,
+    max_concurrency: int | None = None,
+    max_rps: float | None = None,
+) -> int:
+    """
+    Параллельная загрузка деталей вакансий: один HTTP/2-клиент с пулом соединений на всю выгрузку,
+    token bucket по лимитам hh.ru и не более max_concurrency запросов одновременно.
+    После каждой порции из chunk_size id вызывается on_chunk(детали) в отдельном потоке
+    (запись в БД не блокирует event loop). 404 и ошибки пропускаются. Возвращает число загруженных.
+    """
+    if not vacancy_ids:
+        return 0
+    limiter = make_rate_limiter(max_rps)
+    concurrency = max(1, max_concurrency or settings.hh_max_concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    total = 0
+
+    async with httpx.AsyncClient(
+        http2=settings.hh_http2,
+        timeout=FETCH_DETAIL_TIMEOUT,
+        headers=_get_headers(),
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+    ) as client:
+
+        async def one(vid: str) -> dict[str, Any] | None:
+            async with semaphore:
+                try:
+                    return await _fetch_vacancy_detail_async(client, limiter, vid)
+                except Exception:
+                    return None
+
+        for i in range(0, len(vacancy_ids), chunk_size):
+            results = await asyncio.gather(*(one(vid) for vid in vacancy_ids[i : i + chunk_size]))
+            details = [r for r in results if r]
+            if details:
+                await asyncio.to_thread(on_chunk, details)
+                total += len(details)
+    return total
+
+
+def fetch_vacancy_details(
+    vacancy_ids: list[str],
+    on_chunk: Callable[[list[dict[str, Any]]], None],
+    chunk_size: int = 100,
+    max_concurrency: int | None = None,
+    max_rps: float | None = None,
+) -> int:
+    """Синхронная обёртка над fetch_vacancy_details_async (для ингеста и скриптов)."""
+    return asyncio.run(
+        fetch_vacancy_details_async(
+            vacancy_ids,
+            on_chunk,
+            chunk_size=chunk_size,
+            max_concurrency=max_concurrency,
+            max_rps=max_rps,
+        )
+    )
+
+
+def vacancy_to_text(v: dict[str, Any], description: str | None = None) -> str:
+    """
+    Собрать текст вакансии для эмбеддинга: название, навыки, начало описания.
+    Поля — по убыванию ценности: модель видит только первые ~128 токенов
+    (обрезка по токенам — embeddings.fit_token_budget), поэтому описание идёт последним.
+    description — уже очищенное strip_html описание, если вызывающий код его посчитал.
+    """
     parts = [v.get("name", "")]
-    desc = strip_html(v.get("description"))
-    if desc:
-        parts.append(desc[:3000])  # ограничиваем длину
     if v.get("key_skills"):
         parts.append("Навыки: " + ", ".join(s["name"] for s in v["key_skills"]))
+    desc = description if description is not None else strip_html(v.get("description"))
+    if desc:
+        parts.append(desc[:3000])  # ограничиваем длину
     return "\n".join(parts).strip()
@@ -0,0 +1,295 @@
+"""
+Фоновые задачи массовой выгрузки (этап 1) с чекпоинтами в БД.
+Задача хранит параметры, курсор по пространству (запрос, страница) и план — список hh_id
+со статусом каждого. После рестарта процесса фоновый воркер продолжает с чекпоинта:
+поиск — со следующей страницы, загрузка деталей — только для id в статусе pending.
+"""
+import threading
+import time
+from typing import Any
+
+import psycopg
+from psycopg.types.json import Jsonb
+
+from app.config import settings
+from app.db import get_connection
+from app.hh_client import PER_PAGE_MAX, fetch_vacancies_page, fetch_vacancy_details
+from app.vacancies import (
+    DEFAULT_DATA_ENGINEER_QUERIES,
+    changed_vacancy_ids,
+    copy_raw_vacancies,
+    refresh_stats_snapshot,
+)
+
+# Статусы задачи: pending → searching → fetching → done (или failed)
+JOB_ACTIVE_STATUSES = ("pending", "searching", "fetching")
+# Статусы id в плане: pending (ждёт загрузки), done, skipped (уже в raw_vacancies и не изменился), failed
+JOB_ITEM_STATUSES = ("pending", "done", "skipped", "failed")
+# Пространство ключей pg_advisory_lock для задач выгрузки
+_JOB_LOCK_NAMESPACE = 7301
+# Пауза между страницами поиска (как в fetch_vacancies)
+SEARCH_PAGE_DELAY_SEC = 1.2
+
+
+class JobStopped(Exception):
+    """Воркер останавливается; задача остаётся активной и продолжится с чекпоинта."""
+
+
+def create_ingest_job(
+    search_queries: list[str] | None = None,
+    target_count: int = 1000,
+    chunk_size: int = 100,
+    per_page: int = PER_PAGE_MAX,
+    max_pages_per_query: int = 5,
+    search_field: str = "name",
+    detail_delay_sec: float | None = None,
+) -> int:
+    """Создать задачу выгрузки; выполнит её фоновый воркер (или run_ingest_job). Возвращает id задачи."""
+    params = {
+        "search_queries": search_queries or DEFAULT_DATA_ENGINEER_QUERIES,
+        "target_count": target_count,
+        "chunk_size": chunk_size,
+        "per_page": per_page,
+        "max_pages_per_query": max_pages_per_query,
+        "search_field": search_field,
+        "detail_delay_sec": detail_delay_sec,
+    }
+    with get_connection() as conn:
+        cur = conn.execute(
+            "INSERT INTO public.ingest_jobs (params) VALUES (%s) RETURNING id",
+            (Jsonb(params),),
+        )
+        return cur.fetchone()[0]
+
+
+def get_ingest_job(job_id: int) -> dict[str, Any] | None:
+    """Состояние задачи: статус, параметры, курсор поиска и счётчики id по статусам."""
+    with get_connection() as conn:
+        cur = conn.execute(
+            """
+            SELECT id, status, params, search_cursor, error, created_at, updated_at
+            FROM public.ingest_jobs WHERE id = %s
+            """,
+            (job_id,),
+        )
+        row = cur.fetchone()
+        if row is None:
+            return None
+        cur = conn.execute(
+            "SELECT status, COUNT(*) FROM public.ingest_job_items WHERE job_id = %s GROUP BY status",
+            (job_id,),
+        )
+        counts = {r[0]: r[1] for r in cur.fetchall()}
+    items = {status: counts.get(status, 0) for status in JOB_ITEM_STATUSES}
+    return {
+        "id": row[0],
+        "status": row[1],
+        "params": row[2],
+        "search_cursor": row[3],
+        "error": row[4],
+        "created_at": row[5],
+        "updated_at": row[6],
+        "planned": sum(items.values()),
+        "items": items,
+    }
+
+
+def resume_ingest_job(job_id: int) -> bool:
+    """Вернуть упавшую задачу в очередь; продолжится с сохранённого курсора и плана."""
+    with get_connection() as conn:
+        cur = conn.execute(
+            "UPDATE public.ingest_jobs SET status = 'pending', error = NULL, updated_at = NOW() "
+            "WHERE id = %s AND status = 'failed'",
+            (job_id,),
+        )
+        return cur.rowcount > 0
+
+
+def _set_status(job_id: int, status: str, error: str | None = None) -> None:
+    with get_connection() as conn:
+        conn.execute(
+            "UPDATE public.ingest_jobs SET status = %s, error = %s, updated_at = NOW() WHERE id = %s",
+            (status, error, job_id),
+        )
+
+
+def _plan_ids(job_id: int, params: dict[str, Any], cursor: dict[str, Any], stop: threading.Event | None) -> None:
+    """Фаза поиска: постранично добавлять id в план, сохраняя курсор после каждой страницы."""
+    queries: list[str] = params["search_queries"]
+    target = params["target_count"]
+    max_pages = params["max_pages_per_query"]
+    query_index = cursor.get("query_index", 0)
+    page = cursor.get("page", 0)
+
+    with get_connection() as conn:
+        cur = conn.execute("SELECT COUNT(*) FROM public.ingest_job_items WHERE job_id = %s", (job_id,))
+        planned = cur.fetchone()[0]
+
+    while query_index < len(queries) and planned < target:
+        if stop is not None and stop.is_set():
+            raise JobStopped
+        items, pages = fetch_vacancies_page(
+            queries[query_index],
+            page,
+            per_page=params["per_page"],
+            search_field=params["search_field"],
+        )
+        ids = list(dict.fromkeys(str(it["id"]) for it in items if it.get("id")))
+        if page + 1 >= min(pages, max_pages) or not items:
+            query_index, page = query_index + 1, 0
+        else:
+            page += 1
+
+        with get_connection() as conn:
+            # Детали нужны только новым и изменившимся (по published_at/updated_at из выдачи)
+            changed = changed_vacancy_ids(conn, items)
+            cur = conn.execute(
+                """
+                INSERT INTO public.ingest_job_items (job_id, hh_id, position, status)
+                SELECT %s, t.hh_id, %s + t.ord, CASE WHEN t.hh_id = ANY(%s::text[]) THEN 'pending' ELSE 'skipped' END
+                FROM unnest(%s::text[]) WITH ORDINALITY AS t(hh_id, ord)
+                ORDER BY t.ord
+                LIMIT %s
+                ON CONFLICT (job_id, hh_id) DO NOTHING
+                """,
+                (job_id, planned, changed, ids, target - planned),
+            )
+            planned += cur.rowcount
+            # Курсор и новые id плана фиксируются в одной транзакции
+            conn.execute(
+                "UPDATE public.ingest_jobs SET search_cursor = %s, updated_at = NOW() WHERE id = %s",
+                (Jsonb({"query_index": query_index, "page": page}), job_id),
+            )
+        time.sleep(SEARCH_PAGE_DELAY_SEC)
+
+
+def _fetch_planned(job_id: int, params: dict[str, Any], stop: threading.Event | None) -> None:
+    """Фаза загрузки: детали для id в статусе pending; запись в raw и отметка done — в одной транзакции."""
+    with get_connection() as conn:
+        cur = conn.execute(
+            "SELECT hh_id FROM public.ingest_job_items WHERE job_id = %s AND status = 'pending' ORDER BY position",
+            (job_id,),
+        )
+        pending = [r[0] for r in cur.fetchall()]
+    if not pending:
+        return
+
+    def save_chunk(details: list[dict[str, Any]]) -> None:
+        with get_connection() as conn:
+            copy_raw_vacancies(conn, [(str(full["id"]), full) for full in details])
+            conn.execute(
+                "UPDATE public.ingest_job_items SET status = 'done' WHERE job_id = %s AND hh_id = ANY(%s)",
+                (job_id, [str(full["id"]) for full in details]),
+            )
+        if stop is not None and stop.is_set():
+            raise JobStopped
+
+    delay = params.get("detail_delay_sec")
+    fetch_vacancy_details(
+        pending,
+        save_chunk,
+        chunk_size=params["chunk_size"],
+        max_rps=1.0 / delay if delay else None,
+    )
+    # Всё, что осталось pending после полного прохода, — 404 или ошибки после повторов
+    with get_connection() as conn:
+        conn.execute(
+            "UPDATE public.ingest_job_items SET status = 'failed' WHERE job_id = %s AND status = 'pending'",
+            (job_id,),
+        )
+    refresh_stats_snapshot()
+
+
+def run_ingest_job(job_id: int, stop: threading.Event | None = None) -> bool:
+    """
+    Выполнить (или продолжить) задачу. Возвращает False, если задачу уже выполняет другой
+    процесс (session-level pg_advisory_lock) или она не активна.
+    Блокировка держится на отдельном соединении вне пула: задача идёт долго, и занятое ею
+    соединение из пула не должно отнимать место у ингеста и API (как в rebuild_ann_index).
+    """
+    with psycopg.connect(settings.database_url, autocommit=True) as lock_conn:
+        cur = lock_conn.execute("SELECT pg_try_advisory_lock(%s, %s)", (_JOB_LOCK_NAMESPACE, job_id))
+        if not cur.fetchone()[0]:
+            return False
+        try:
+            with get_connection() as conn:
+                cur = conn.execute(
+                    "SELECT status, params, search_cursor FROM public.ingest_jobs WHERE id = %s",
+                    (job_id,),
+                )
+                row = cur.fetchone()
+            if row is None or row[0] not in JOB_ACTIVE_STATUSES:
+                return False
+            status, params, cursor = row
+            try:
+                if status in ("pending", "searching"):
+                    _set_status(job_id, "searching")
+                    _plan_ids(job_id, params, cursor or {}, stop)
+                _set_status(job_id, "fetching")
+                _fetch_planned(job_id, params, stop)
+                _set_status(job_id, "done")
+            except JobStopped:
+                return False
+            except Exception as e:
+                _set_status(job_id, "failed", error=str(e))
+            return True
+        finally:
+            lock_conn.execute("SELECT pg_advisory_unlock(%s, %s)", (_JOB_LOCK_NAMESPACE, job_id))
+
+
+class IngestWorker:
+    """Фоновый поток: забирает активные задачи из public.ingest_jobs и выполняет их по одной."""
+
+    def __init__(self, poll_sec: float) -> None:
+        self.poll_sec = poll_sec
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="ingest-worker", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            ran = False
+            try:
+                with get_connection() as conn:
+                    cur = conn.execute(
+                        "SELECT id FROM public.ingest_jobs WHERE status = ANY(%s) ORDER BY id",
+                        (list(JOB_ACTIVE_STATUSES),),
+                    )
+                    job_ids = [r[0] for r in cur.fetchall()]
+                for job_id in job_ids:
+                    if self._stop.is_set():
+                        break
+                    ran = run_ingest_job(job_id, stop=self._stop) or ran
+            except Exception:
+                # БД недоступна и т.п. — повторим после паузы
+                pass
+            if not ran:
+                self._stop.wait(self.poll_sec)
+
+
+_worker: IngestWorker | None = None
+
+
+def start_ingest_worker() -> None:
+    global _worker
+    if _worker is None:
+        _worker = IngestWorker(settings.ingest_worker_poll_sec)
+        _worker.start()
+
+
+def stop_ingest_worker() -> None:
+    global _worker
+    if _worker is not None:
+        _worker.stop()
+        _worker = None
@@ -1,23 +1,56 @@
 """
 API: индексация вакансий, векторный поиск, RAG (контекст для ответа).
 """
-from fastapi import FastAPI, HTTPException, Query
+from contextlib import asynccontextmanager
+from datetime import date
+
+from fastapi import Depends, FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, field_validator
 
-from app.skills import collect_skills_from_raw, get_skills
+from app.ann_index import AnnIndexBusy, get_ann_index_info, rebuild_ann_index
+from app.cache import get_search_cache
+from app.db import close_async_pool, close_pool, get_async_pool
+from app.config import settings
+from app.embeddings import EmbeddingOverloaded, get_embedding_batcher, stop_embedding_batcher
+from app.jobs import (
+    create_ingest_job,
+    get_ingest_job,
+    resume_ingest_job,
+    start_ingest_worker,
+    stop_ingest_worker,
+)
+from app.skills import collect_skills_from_raw, get_skill_areas, get_skill_cooccurrence, get_skills
 from app.vacancies import (
     DEFAULT_DATA_ENGINEER_QUERIES,
+    SEARCH_FILTERS,
+    SEARCH_MODES,
+    get_pipeline_metrics,
     get_stats,
     load_and_index_vacancies,
     load_and_index_vacancies_multi,
     process_raw_to_rag,
-    search_similar,
+    search_similar_async,
+    search_similar_batch_async,
 )
 
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    await get_async_pool()
+    if settings.ingest_worker_enabled:
+        start_ingest_worker()
+    yield
+    stop_ingest_worker()
+    await stop_embedding_batcher()
+    await close_async_pool()
+    close_pool()
+
+
 app = FastAPI(
     title="RAG HH",
     description="Векторный поиск по вакансиям hh.ru с pgvector. RAG: семантический поиск + контекст.",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -40,7 +73,8 @@ class IngestBulkRequest(BaseModel):
     search_queries: list[str] | None = None
     target_count: int = 1000
     chunk_size: int = 10
-    detail_delay_sec: float = 2.0
+    # Мин. пауза между запросами деталей (верхняя граница RPS); None — скорость по лимитам hh.ru (HH_*_RPS)
+    detail_delay_sec: float | None = None
 
 
 class EmbedFromRawRequest(BaseModel):
@@ -48,6 +82,20 @@ class EmbedFromRawRequest(BaseModel):
 
     limit: int | None = None  # макс. строк из raw (None = все)
     chunk_size: int = 50  # пачка для embed_batch
+    incremental: bool = True  # только новые и изменившиеся вакансии (False — пересчитать всё)
+
+
+class AnnIndexRebuildRequest(BaseModel):
+    """Пересборка ANN-индекса; не заданные параметры берутся из настроек (ANN_*)."""
+
+    index_type: str | None = None  # hnsw | ivfflat
+    m: int | None = None  # HNSW
+    ef_construction: int | None = None  # HNSW
+    lists: int | None = None  # IVFFlat; None — по числу строк
+
+
+# Допустимые значения ?mode= для /search и /rag — из SEARCH_MODES
+SEARCH_MODE_PATTERN = f"^({'|'.join(SEARCH_MODES)})$"
 
 
 class SearchRequest(BaseModel):
@@ -55,20 +103,58 @@ class SearchRequest(BaseModel):
     limit: int = 10
 
 
+class SearchBatchRequest(BaseModel):
+    """Пакетный поиск: много запросов — один инференс и один запрос к БД. Фильтры и mode — как у /search."""
+
+    queries: list[str] = Field(..., min_length=1, max_length=500)
+    limit: int = Field(10, ge=1, le=50)
+    ef_search: int | None = Field(None, ge=1, le=1000)
+    probes: int | None = Field(None, ge=1, le=10000)
+    mode: str = Field("semantic", pattern=SEARCH_MODE_PATTERN)
+    area: str | None = None
+    employer: str | None = None
+    salary_min: int | None = Field(None, ge=0)
+    salary_max: int | None = Field(None, ge=0)
+    published_after: date | None = None
+
+    @field_validator("queries")
+    @classmethod
+    def _queries_not_blank(cls, queries: list[str]) -> list[str]:
+        blank = [i for i, q in enumerate(queries) if not q.strip()]
+        if blank:
+            raise ValueError(f"Empty queries at positions {blank}")
+        return queries
+
+
 @app.get("/health")
-def health():
+async def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """
+    Метрики процесса: очередь и размеры батчей инференса эмбеддингов запросов, попадания в кэш поиска,
+    загрузка стадий последнего прогона этапа 2.
+    """
+    return {
+        "embedding_batcher": get_embedding_batcher().metrics(),
+        "search_cache": get_search_cache().metrics(),
+        "embed_pipeline": get_pipeline_metrics(),
+    }
+
+
 @app.post("/skills/collect")
-def skills_collect():
+def skills_collect(
+    full: bool = Query(False, description="Пересобрать навыки по всем вакансиям, а не только по новым и изменившимся"),
+):
     """
     Собрать навыки из public.raw_vacancies (поле key_skills в raw_json)
     и заполнить таблицы public.skills и public.vacancy_skills.
-    Вызывать после загрузки сырых вакансий.
+    Вызывать после загрузки сырых вакансий; обрабатываются только новые и изменившиеся.
     """
     try:
-        result = collect_skills_from_raw()
+        result = collect_skills_from_raw(full=full)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -86,11 +172,40 @@ def skills_list(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/skills/cooccurrence")
+def skills_cooccurrence(
+    skill: str | None = Query(None, description="Навык; без него — самые частые пары навыков"),
+    limit: int = Query(50, ge=1, le=1000),
+):
+    """Навыки, встречающиеся в одних вакансиях (из предрасчитанной статистики)."""
+    try:
+        return {"pairs": get_skill_cooccurrence(skill=skill, limit=limit)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/skills/areas")
+def skills_areas(
+    skill: str | None = Query(None, description="Навык; без него — самые частые пары навык — регион"),
+    limit: int = Query(50, ge=1, le=1000),
+):
+    """Число вакансий с навыком по регионам (из предрасчитанной статистики)."""
+    try:
+        return {"areas": get_skill_areas(skill=skill, limit=limit)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.get("/stats")
-def stats():
-    """Статистика по индексированным вакансиям: количество, компании, регионы, зарплаты."""
+def stats(
+    fresh: bool = Query(False, description="Пересчитать статистику сейчас, а не отдать последний снимок"),
+):
+    """
+    Статистика по индексированным вакансиям: количество, компании, регионы, зарплаты.
+    Отдаётся снимок, пересчитанный после последней загрузки (computed_at — время расчёта).
+    """
     try:
-        return get_stats()
+        return get_stats(fresh=fresh)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -124,7 +239,7 @@ def ingest_bulk(body: IngestBulkRequest | None = None):
             search_queries=body.search_queries,
             target_count=min(body.target_count, 2000),
             chunk_size=min(max(body.chunk_size, 5), 100),
-            detail_delay_sec=max(1.0, min(body.detail_delay_sec, 30.0)),
+            detail_delay_sec=min(body.detail_delay_sec, 30.0) if body.detail_delay_sec else None,
         )
         queries = body.search_queries or DEFAULT_DATA_ENGINEER_QUERIES
         return {"saved_to_raw": n, "search_queries": queries, "target_count": body.target_count}
@@ -132,24 +247,133 @@ def ingest_bulk(body: IngestBulkRequest | None = None):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/ingest/jobs")
+def ingest_job_create(body: IngestBulkRequest | None = None):
+    """
+    Этап 1 в фоне: создать задачу выгрузки до target_count вакансий в public.raw_vacancies.
+    План id и курсор поиска хранятся в БД — после рестарта задача продолжится с чекпоинта,
+    уже выгруженные вакансии повторно не загружаются. Прогресс: GET /ingest/jobs/{id}.
+    """
+    body = body or IngestBulkRequest()
+    try:
+        job_id = create_ingest_job(
+            search_queries=body.search_queries,
+            target_count=body.target_count,
+            chunk_size=min(max(body.chunk_size, 5), 500),
+            detail_delay_sec=min(body.detail_delay_sec, 30.0) if body.detail_delay_sec else None,
+        )
+        return {"job_id": job_id, "status": "pending"}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/ingest/jobs/{job_id}")
+def ingest_job_status(job_id: int):
+    """Прогресс задачи выгрузки: статус, курсор поиска, число id по статусам (pending/done/skipped/failed)."""
+    try:
+        job = get_ingest_job(job_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@app.post("/ingest/jobs/{job_id}/resume")
+def ingest_job_resume(job_id: int):
+    """Повторно запустить упавшую задачу (status = failed) с сохранённого чекпоинта."""
+    try:
+        resumed = resume_ingest_job(job_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if not resumed:
+        raise HTTPException(status_code=409, detail="Job is not in failed state")
+    return {"job_id": job_id, "status": "pending"}
+
+
 @app.post("/ingest/embed")
 def ingest_embed(body: EmbedFromRawRequest | None = None):
     """
     Этап 2: прочитать public.raw_vacancies, построить эмбеддинги и записать в public.rag_vacancies.
     Вызывать после POST /ingest или POST /ingest/bulk.
+    По умолчанию инкрементально: вакансии без изменений пропускаются (skipped).
+    pipeline — время и загрузка стадий (чтение, подготовка, инференс, запись) и узкое место.
     """
     body = body or EmbedFromRawRequest()
     try:
-        n = process_raw_to_rag(limit=body.limit, chunk_size=min(max(body.chunk_size, 10), 200))
-        return {"rag_indexed": n, "limit": body.limit}
+        result = process_raw_to_rag(
+            limit=body.limit,
+            chunk_size=min(max(body.chunk_size, 10), 200),
+            incremental=body.incremental,
+        )
+        return {"rag_indexed": result["processed"], **result, "limit": body.limit}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/admin/ann-index")
+def ann_index_info():
+    """Текущий ANN-индекс по эмбеддингам: тип, определение, оценка числа строк, параметры поиска."""
+    try:
+        return get_ann_index_info()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/admin/ann-index/rebuild")
+def ann_index_rebuild(body: AnnIndexRebuildRequest | None = None):
+    """
+    Пересобрать ANN-индекс (CREATE INDEX CONCURRENTLY, поиск при этом работает).
+    Вызывать после крупной загрузки: для IVFFlat lists пересчитывается по числу строк.
+    """
+    body = body or AnnIndexRebuildRequest()
+    try:
+        return rebuild_ann_index(
+            index_type=body.index_type,
+            m=body.m,
+            ef_construction=body.ef_construction,
+            lists=body.lists,
+        )
+    except AnnIndexBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def search_filters(
+    area: str | None = Query(None, description="Регион (area_name), например «Москва»"),
+    employer: str | None = Query(None, description="Работодатель (employer_name)"),
+    salary_min: int | None = Query(None, ge=0, description="Зарплата не ниже (вилка пересекается с [salary_min, ∞))"),
+    salary_max: int | None = Query(None, ge=0, description="Нижняя граница вилки не выше"),
+    published_after: date | None = Query(None, description="Опубликована не раньше (YYYY-MM-DD)"),
+) -> dict:
+    """
+    Фильтры поиска для /search и /rag (ключи SEARCH_FILTERS).
+    async: синхронную зависимость FastAPI выполнял бы в общем пуле потоков, занятом ингестом.
+    """
+    return {
+        "area": area,
+        "employer": employer,
+        "salary_min": salary_min,
+        "salary_max": salary_max,
+        "published_after": published_after,
+    }
+
+
 @app.get("/search")
-def search(
+async def search(
     q: str = Query(..., description="Поисковый запрос (семантический)"),
     limit: int = Query(10, ge=1, le=50),
+    ef_search: int | None = Query(None, ge=1, le=1000, description="hnsw.ef_search для запроса (точность HNSW)"),
+    probes: int | None = Query(None, ge=1, le=10000, description="ivfflat.probes для запроса (точность IVFFlat)"),
+    filters: dict = Depends(search_filters),
+    mode: str = Query(
+        "semantic",
+        pattern=SEARCH_MODE_PATTERN,
+        description="semantic — векторный поиск; hybrid — векторный + полнотекстовый со слиянием по RRF",
+    ),
 ):
     """
     Векторный поиск: запрос переводится в эмбеддинг, ищутся ближайшие вакансии (cosine).
@@ -157,16 +381,51 @@ def search(
     if not q.strip():
         raise HTTPException(status_code=400, detail="Query is empty")
     try:
-        results = search_similar(query=q, limit=limit)
+        results = await search_similar_async(
+            query=q, limit=limit, ef_search=ef_search, probes=probes, filters=filters, mode=mode
+        )
         return {"query": q, "results": results}
+    except EmbeddingOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/search/batch")
+async def search_batch(body: SearchBatchRequest):
+    """
+    Векторный поиск по списку запросов: эмбеддинги — одним батчем, поиск — одним SQL-запросом
+    (LATERAL по массиву векторов; в режиме hybrid — запрос на каждый, одним пакетом).
+    Ответ — результаты по каждому запросу.
+    """
+    try:
+        results = await search_similar_batch_async(
+            body.queries,
+            limit=body.limit,
+            ef_search=body.ef_search,
+            probes=body.probes,
+            filters=body.model_dump(include=set(SEARCH_FILTERS)),
+            mode=body.mode,
+        )
+        return {"results": results}
+    except EmbeddingOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/rag")
-def rag(
+async def rag(
     q: str = Query(..., description="Вопрос для RAG"),
     limit: int = Query(5, ge=1, le=20),
+    ef_search: int | None = Query(None, ge=1, le=1000, description="hnsw.ef_search для запроса (точность HNSW)"),
+    probes: int | None = Query(None, ge=1, le=10000, description="ivfflat.probes для запроса (точность IVFFlat)"),
+    filters: dict = Depends(search_filters),
+    mode: str = Query(
+        "semantic",
+        pattern=SEARCH_MODE_PATTERN,
+        description="semantic — векторный поиск; hybrid — векторный + полнотекстовый со слиянием по RRF",
+    ),
 ):
     """
     RAG: семантический поиск по вакансиям + возврат контекста (топ-N вакансий).
@@ -175,7 +434,9 @@ def rag(
     if not q.strip():
         raise HTTPException(status_code=400, detail="Query is empty")
     try:
-        results = search_similar(query=q, limit=limit)
+        results = await search_similar_async(
+            query=q, limit=limit, ef_search=ef_search, probes=probes, filters=filters, mode=mode
+        )
         context_parts = []
         for i, r in enumerate(results, 1):
             ctx = f"[Вакансия {i}] {r['name']}"
@@ -192,5 +453,7 @@ def rag(
             "context": context,
             "sources": [{"name": r["name"], "url": r["url"], "similarity": r["similarity"]} for r in results],
         }
+    except EmbeddingOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,200 @@
+"""
+Конвейер из стадий на потоках с ограниченными очередями между ними.
+Источник и стадии работают одновременно: пока одна пачка в инференсе, следующая читается
+из БД и готовится, предыдущая пишется. Очереди ограничены — быстрая стадия упирается
+в медленную (backpressure), память не растёт. По каждой стадии — счётчики занятости,
+простоя в ожидании входа и блокировки на выходе: стадия с максимальной загрузкой — узкое место.
+"""
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable
+
+# Конец потока данных: каждый поток стадии, получив его, завершается
+_END = object()
+
+
+@dataclass
+class Stage:
+    """Стадия: fn(пачка) -> пачка для следующей стадии (None — дальше не передавать); workers — число потоков."""
+
+    name: str
+    fn: Callable[[Any], Any]
+    workers: int = 1
+
+
+@dataclass
+class StageStats:
+    name: str
+    workers: int
+    batches: int = 0
+    items: int = 0
+    busy_sec: float = 0.0
+    wait_in_sec: float = 0.0
+    wait_out_sec: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, items: int, busy: float, wait_in: float, wait_out: float) -> None:
+        with self._lock:
+            self.batches += 1
+            self.items += items
+            self.busy_sec += busy
+            self.wait_in_sec += wait_in
+            self.wait_out_sec += wait_out
+
+    def as_dict(self, elapsed: float) -> dict[str, Any]:
+        capacity = elapsed * self.workers
+        return {
+            "workers": self.workers,
+            "batches": self.batches,
+            "items": self.items,
+            "busy_sec": round(self.busy_sec, 3),
+            "wait_in_sec": round(self.wait_in_sec, 3),
+            "wait_out_sec": round(self.wait_out_sec, 3),
+            # пропускная способность стадии при её текущем числе потоков
+            "items_per_sec": round(self.items / self.busy_sec * self.workers, 1) if self.busy_sec else 0,
+            "utilization": round(self.busy_sec / capacity, 3) if capacity else 0,
+        }
+
+
+def _size(batch: Any) -> int:
+    return len(batch) if hasattr(batch, "__len__") else 1
+
+
+class Pipeline:
+    """
+    source — итератор пачек (читается в своём потоке, как стадия "source"); stages — по порядку.
+    Первая ошибка в любой стадии останавливает конвейер и пробрасывается из run().
+    """
+
+    def __init__(self, source: Iterable[Any], stages: list[Stage], queue_size: int = 4) -> None:
+        self.source = source
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self.stats = [StageStats("source", 1)] + [StageStats(s.name, max(1, s.workers)) for s in stages]
+        self.elapsed_sec = 0.0
+        self._stop = threading.Event()
+        self._error: BaseException | None = None
+
+    def _put(self, q: queue.Queue, item: Any) -> None:
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, q: queue.Queue) -> Any:
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _fail(self, e: BaseException) -> None:
+        if self._error is None:
+            self._error = e
+        self._stop.set()
+
+    def _run_source(self, out: queue.Queue, consumers: int) -> None:
+        stats = self.stats[0]
+        try:
+            it = iter(self.source)
+            while not self._stop.is_set():
+                started = time.perf_counter()
+                batch = next(it, _END)
+                if batch is _END:
+                    break
+                busy = time.perf_counter() - started
+                started = time.perf_counter()
+                self._put(out, batch)
+                stats.add(_size(batch), busy, 0.0, time.perf_counter() - started)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            for _ in range(consumers):
+                self._put(out, _END)
+
+    def _run_worker(
+        self,
+        stage: Stage,
+        stats: StageStats,
+        inp: queue.Queue,
+        out: queue.Queue | None,
+        done: Callable[[], None],
+    ) -> None:
+        try:
+            while True:
+                started = time.perf_counter()
+                batch = self._get(inp)
+                wait_in = time.perf_counter() - started
+                if batch is _END:
+                    break
+                started = time.perf_counter()
+                result = stage.fn(batch)
+                busy = time.perf_counter() - started
+                wait_out = 0.0
+                if out is not None and result is not None:
+                    started = time.perf_counter()
+                    self._put(out, result)
+                    wait_out = time.perf_counter() - started
+                stats.add(_size(batch), busy, wait_in, wait_out)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            done()
+
+    def run(self) -> None:
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        threads = [
+            threading.Thread(
+                target=self._run_source,
+                args=(queues[0], self.stats[1].workers),
+                name="pipeline-source",
+                daemon=True,
+            )
+        ]
+        for i, stage in enumerate(self.stages):
+            stats = self.stats[i + 1]
+            out = queues[i + 1] if i + 1 < len(queues) else None
+            consumers = self.stats[i + 2].workers if out is not None else 0
+            # Последний завершившийся поток стадии передаёт конец потока следующей
+            remaining = [stats.workers]
+            lock = threading.Lock()
+
+            def done(out=out, consumers=consumers, remaining=remaining, lock=lock) -> None:
+                with lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last and out is not None:
+                    for _ in range(consumers):
+                        self._put(out, _END)
+
+            for n in range(stats.workers):
+                threads.append(
+                    threading.Thread(
+                        target=self._run_worker,
+                        args=(stage, stats, queues[i], out, done),
+                        name=f"pipeline-{stage.name}-{n}",
+                        daemon=True,
+                    )
+                )
+
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.elapsed_sec = time.perf_counter() - started
+        if self._error is not None:
+            raise self._error
+
+    def metrics(self) -> dict[str, Any]:
+        stages = {s.name: s.as_dict(self.elapsed_sec) for s in self.stats}
+        return {
+            "elapsed_sec": round(self.elapsed_sec, 3),
+            "stages": stages,
+            "bottleneck": max(stages, key=lambda n: stages[n]["utilization"]) if self.elapsed_sec else None,
+        }
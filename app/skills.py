@@ -2,12 +2,15 @@
 Сбор навыков из сырых вакансий: key_skills + поиск по названию и описанию (глубокий анализ).
 """
 import json
+import multiprocessing
 import re
-from typing import Any
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import Any, Iterable, Iterator
 
 import psycopg
 
-from app.db import get_connection_sync
+from app.config import settings
+from app.db import get_connection, stream_query
 from app.hh_client import strip_html
 
 # Дополнительные технические навыки для поиска в тексте вакансии (если нет в key_skills)
@@ -100,6 +103,38 @@ KNOWN_HARD_SKILLS = [
 ]
 
 
+# Хэш полей raw_json, от которых зависят навыки вакансии (название, описание, key_skills).
+# Считается в SQL, чтобы отбирать новые и изменившиеся вакансии без чтения JSON в Python.
+_SKILLS_HASH_SQL = (
+    "md5(concat_ws(E'\\x1f', r.raw_json->>'name', r.raw_json->>'description', r.raw_json->'key_skills'))"
+)
+# Проход 1: id, хэш и key_skills новых/изменившихся вакансий (при full — всех)
+_CHANGED_SELECT = f"""
+    SELECT r.hh_id, {_SKILLS_HASH_SQL}, r.raw_json->'key_skills'
+    FROM public.raw_vacancies r
+    LEFT JOIN public.vacancy_skills_state s ON s.hh_id = r.hh_id
+    WHERE s.hh_id IS NULL OR s.content_hash <> {_SKILLS_HASH_SQL}
+    ORDER BY r.hh_id
+"""
+_ALL_SELECT = f"""
+    SELECT r.hh_id, {_SKILLS_HASH_SQL}, r.raw_json->'key_skills'
+    FROM public.raw_vacancies r
+    ORDER BY r.hh_id
+"""
+# Проход 2: тексты отобранных вакансий — только нужные поля raw_json (jsonb-операторами).
+# Описание берётся уже очищенным этапом 2 из rag_vacancies; HTML из raw — только для вакансий,
+# ещё не прошедших этап 2. Запись этапа 2 сбрасывает vacancy_skills_state (copy_rag_vacancies),
+# так что навыки пересчитываются и по обновлённому описанию
+_RAW_BY_IDS_SELECT = """
+    SELECT r.hh_id, r.raw_json->>'name', g.description,
+           CASE WHEN g.hh_id IS NULL THEN r.raw_json->>'description' END, r.raw_json->'key_skills'
+    FROM public.raw_vacancies r LEFT JOIN public.rag_vacancies g ON g.hh_id = r.hh_id
+    WHERE r.hh_id = ANY(%s::text[]) ORDER BY r.hh_id
+"""
+RAW_PAGE_SIZE = 500
+# Ключ pg_advisory_xact_lock: пересборки vacancy_skills выполняются по одной
+_SKILLS_LOCK_KEY = 7302
+
 
 def normalize_skill_name(name: str) -> str:
     """Нормализация названия навыка: lowercase, обрезка пробелов, схлопывание пробелов."""
@@ -109,161 +144,302 @@ def normalize_skill_name(name: str) -> str:
     return s[:255]  # ограничение по колонке
 
 
-def _skill_matches_text(skill_name: str, text: str) -> bool:
-    """Проверка, что навык упоминается в тексте (целое слово или фраза)."""
-    if not skill_name or not text:
-        return False
-    text_lower = text.lower()
-    if " " in skill_name:
-        return skill_name in text_lower
-    # Одно слово — по границам слова, чтобы не ловить "python" в "pythonic"
-    pattern = r"\b" + re.escape(skill_name) + r"\b"
-    return bool(re.search(pattern, text_lower))
+def _trie_regex(words: Iterable[str]) -> str:
+    """
+    Регулярное выражение-trie по набору строк: общие префиксы вынесены,
+    поэтому движок re проверяет в каждой позиции одну ветку, а не тысячи альтернатив.
+    """
+    trie: dict[str, Any] = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node: dict[str, Any]) -> str:
+        is_end = "" in node
+        alternatives = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not alternatives:
+            return ""
+        if len(alternatives) == 1 and not is_end:
+            return alternatives[0]
+        group = "(?:" + "|".join(alternatives) + ")"
+        return group + "?" if is_end else group
+
+    return build(trie)
+
+
+class SkillMatcher:
+    """
+    Поиск навыков из словаря в тексте за один проход.
+    Словарь компилируется один раз в trie-регулярку; совпадение — целое слово или фраза
+    (слева и справа не буква/цифра/_), так что "python" не ловится в "pythonic".
+    В каждой позиции находится самый длинный навык, а вложенные в него более короткие
+    (например "apache spark" → "apache") добавляются по заранее посчитанной таблице префиксов.
+    """
+
+    def __init__(self, skill_names: Iterable[str]) -> None:
+        names = {n for n in skill_names if n}
+        self.size = len(names)
+        self._pattern = (
+            re.compile(r"(?<!\w)(?=(" + _trie_regex(names) + r")(?!\w))") if names else None
+        )
+        # Для каждого навыка — другие навыки, которые являются его префиксом и после которых
+        # в нём идёт не буквенно-цифровой символ (то есть тоже совпадают в той же позиции)
+        word_char = re.compile(r"\w")
+        self._prefixes: dict[str, tuple[str, ...]] = {
+            name: tuple(
+                name[:k] for k in range(1, len(name)) if name[:k] in names and not word_char.match(name[k])
+            )
+            for name in names
+        }
+
+    def find(self, text: str) -> set[str]:
+        """Навыки словаря, упомянутые в тексте."""
+        if not text or self._pattern is None:
+            return set()
+        found: set[str] = set()
+        for m in self._pattern.finditer(text.lower()):
+            name = m.group(1)
+            if name not in found:
+                found.add(name)
+                found.update(self._prefixes[name])
+        return found
 
 
-def _build_vacancy_text(raw: dict[str, Any]) -> str:
-    """Текст вакансии для поиска навыков: название + описание без HTML."""
+def _build_vacancy_text(name: str | None, description: str | None, raw_html: str | None) -> str:
+    """
+    Текст вакансии для поиска навыков: название + описание без HTML.
+    description — очищенное описание из rag_vacancies; raw_html очищается, только если его нет.
+    """
     parts = []
-    if raw.get("name"):
-        parts.append(str(raw["name"]))
-    desc = raw.get("description")
-    if desc:
-        clean = strip_html(desc)
-        if clean:
-            parts.append(clean)
+    if name:
+        parts.append(name)
+    clean = description if description is not None else strip_html(raw_html)
+    if clean:
+        parts.append(clean)
     return " ".join(parts)
 
 
-def collect_skills_from_raw() -> dict[str, Any]:
+def _key_skill_names(key_skills: Any) -> set[str]:
+    """Нормализованные имена из key_skills ([{"name": ...}] или список строк)."""
+    if isinstance(key_skills, str):
+        key_skills = json.loads(key_skills)
+    names = set()
+    for s in key_skills or []:
+        if isinstance(s, dict) and s.get("name"):
+            n = normalize_skill_name(s["name"])
+        elif isinstance(s, str):
+            n = normalize_skill_name(s)
+        else:
+            continue
+        if n:
+            names.add(n)
+    return names
+
+
+# Тип результата по шарду: id вакансий, связи (hh_id, skill_id), число связей из key_skills и из текста
+_ShardResult = tuple[list[str], list[tuple[str, int]], int, int]
+
+
+def _match_rows(
+    rows: Iterable[tuple[str, str | None, str | None, str | None, Any]],
+    matcher: SkillMatcher,
+    name_to_id: dict[str, int],
+) -> _ShardResult:
+    """
+    Связи вакансия — навык для страницы строк _RAW_BY_IDS_SELECT
+    (hh_id, name, description, raw_html, key_skills).
+    """
+    page_ids: list[str] = []
+    links: list[tuple[str, int]] = []
+    from_key_skills = 0
+    from_text = 0
+    for hh_id, name, description, raw_html, key_skills in rows:
+        page_ids.append(hh_id)
+        key_ids = {name_to_id[n] for n in _key_skill_names(key_skills) if n in name_to_id}
+        text_ids = {name_to_id[n] for n in matcher.find(_build_vacancy_text(name, description, raw_html))} - key_ids
+        from_key_skills += len(key_ids)
+        from_text += len(text_ids)
+        links.extend((hh_id, skill_id) for skill_id in key_ids | text_ids)
+    return page_ids, links, from_key_skills, from_text
+
+
+def _match_serial(ids: list[str], matcher: SkillMatcher, name_to_id: dict[str, int]) -> Iterator[_ShardResult]:
+    for page in stream_query(_RAW_BY_IDS_SELECT, (ids,), page_size=RAW_PAGE_SIZE):
+        yield _match_rows(page, matcher, name_to_id)
+
+
+# Состояние процесса пула: словарь, скомпилированный SkillMatcher и своё соединение с БД
+_worker_state: dict[str, Any] = {}
+
+
+def _init_match_worker(database_url: str, name_to_id: dict[str, int]) -> None:
+    """Initializer процесса пула: словарь компилируется один раз на процесс."""
+    _worker_state["name_to_id"] = name_to_id
+    _worker_state["matcher"] = SkillMatcher(name_to_id.keys())
+    # Прямое соединение, а не пул: процесс стартует через spawn и ничего не наследует от родителя
+    _worker_state["conn"] = psycopg.connect(database_url, autocommit=True)
+
+
+def _match_shard(ids: list[str]) -> _ShardResult:
+    """Задача процесса пула: прочитать шард вакансий по hh_id и найти навыки."""
+    cur = _worker_state["conn"].execute(_RAW_BY_IDS_SELECT, (ids,))
+    return _match_rows(cur, _worker_state["matcher"], _worker_state["name_to_id"])
+
+
+def _match_parallel(ids: list[str], name_to_id: dict[str, int], workers: int) -> Iterator[_ShardResult]:
+    """
+    Поиск навыков в пуле процессов: ids (отсортированы по hh_id) режутся на шарды по
+    RAW_PAGE_SIZE, каждый процесс сам читает свой шард из БД и возвращает связи.
+    В работе не больше 2 * workers шардов, результаты отдаются по мере готовности.
     """
-    Двухэтапный сбор навыков:
+    shards = iter([ids[i : i + RAW_PAGE_SIZE] for i in range(0, len(ids), RAW_PAGE_SIZE)])
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_match_worker,
+        initargs=(settings.database_url, name_to_id),
+    ) as pool:
+        pending: set[Future] = set()
+        try:
+            while True:
+                for shard in shards:
+                    pending.add(pool.submit(_match_shard, shard))
+                    if len(pending) >= 2 * workers:
+                        break
+                if not pending:
+                    return
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    yield fut.result()
+        finally:
+            for fut in pending:
+                fut.cancel()
+
+
+def collect_skills_from_raw(full: bool = False, workers: int | None = None) -> dict[str, Any]:
+    """
+    Инкрементальный сбор навыков:
     1) key_skills из API;
     2) поиск по названию и описанию вакансии (KNOWN_HARD_SKILLS + уже известные навыки).
-    Заполняет public.skills и public.vacancy_skills.
+    Обрабатываются только новые и изменившиеся вакансии (хэш полей сверяется с
+    public.vacancy_skills_state); full=True — пересборка по всем вакансиям, нужна, чтобы
+    найти в старых текстах навыки, добавленные в справочник позже.
+    Справочник дополняется одним INSERT, связи пишутся через COPY. Удаление старых связей,
+    запись новых и обновление состояния — одна транзакция: до commit читатели /skills
+    видят прежние данные, после — новые целиком.
+    workers > 1 — поиск по текстам в пуле процессов (по умолчанию settings.skills_workers).
     """
-    conn = get_connection_sync()
-    try:
-        cur = conn.execute("SELECT hh_id, raw_json FROM public.raw_vacancies")
-        rows = cur.fetchall()
-    finally:
-        conn.close()
+    # Проход 1: id, хэши и key_skills отобранных вакансий (без description — в памяти мало)
+    hashes: dict[str, str] = {}
+    all_names: set[str] = set()
+    for page in stream_query(_ALL_SELECT if full else _CHANGED_SELECT, page_size=RAW_PAGE_SIZE):
+        for hh_id, content_hash, key_skills in page:
+            hashes[hh_id] = content_hash
+            all_names.update(_key_skill_names(key_skills))
 
-    if not rows:
+    if not hashes:
         return {
             "skills_added": 0,
             "vacancy_skills_added": 0,
+            "vacancy_skills_from_key_skills": 0,
             "vacancy_skills_from_text": 0,
             "vacancies_processed": 0,
+            "full": full,
         }
 
-    # Этап 1: key_skills
-    vacancy_skill_names: list[tuple[str, set[str]]] = []
-    all_names: set[str] = set()
-    raw_by_id: dict[str, dict] = {}
-
-    for hh_id, raw_json in rows:
-        raw = raw_json if isinstance(raw_json, dict) else json.loads(raw_json)
-        raw_by_id[hh_id] = raw
-        key_skills = raw.get("key_skills") or []
-        names = set()
-        for s in key_skills:
-            if isinstance(s, dict) and s.get("name"):
-                n = normalize_skill_name(s["name"])
-                if n:
-                    names.add(n)
-                    all_names.add(n)
-            elif isinstance(s, str):
-                n = normalize_skill_name(s)
-                if n:
-                    names.add(n)
-                    all_names.add(n)
-        if names:
-            vacancy_skill_names.append((hh_id, names))
-
     # Добавить известные hard skills в справочник (для поиска по тексту)
     for name in KNOWN_HARD_SKILLS:
         n = normalize_skill_name(name)
         if n:
             all_names.add(n)
 
-    conn = get_connection_sync()
-    try:
-        for name in sorted(all_names):
-            conn.execute(
-                "INSERT INTO public.skills (name) VALUES (%s) ON CONFLICT (name) DO NOTHING",
-                (name,),
-            )
-        conn.commit()
-
-        conn.execute("DELETE FROM public.vacancy_skills")
+    with get_connection() as conn:
+        cur = conn.execute(
+            "INSERT INTO public.skills (name) SELECT unnest(%s::text[]) ON CONFLICT (name) DO NOTHING",
+            (sorted(all_names),),
+        )
+        skills_added = cur.rowcount
         conn.commit()
 
         cur = conn.execute("SELECT id, name FROM public.skills")
         name_to_id = {r[1]: r[0] for r in cur.fetchall()}
 
-        # Связи из key_skills
+        ids = list(hashes)
+        conn.execute("SELECT pg_advisory_xact_lock(%s)", (_SKILLS_LOCK_KEY,))
+        if full:
+            conn.execute("DELETE FROM public.vacancy_skills")
+        else:
+            conn.execute("DELETE FROM public.vacancy_skills WHERE hh_id = ANY(%s::text[])", (ids,))
+
+        # Проход 2: тексты отобранных вакансий (в этом процессе или в пуле процессов);
+        # связи и состояние пишутся постранично в ту же транзакцию единственным писателем.
+        # Словарь компилируется один раз на процесс (SkillMatcher), каждый текст сканируется за один проход
+        workers = settings.skills_workers if workers is None else workers
+        if workers > 1:
+            shards = _match_parallel(ids, name_to_id, workers)
+        else:
+            shards = _match_serial(ids, SkillMatcher(name_to_id.keys()), name_to_id)
         from_key_skills = 0
-        for hh_id, names in vacancy_skill_names:
-            for name in names:
-                skill_id = name_to_id.get(name)
-                if skill_id is not None:
-                    try:
-                        conn.execute(
-                            "INSERT INTO public.vacancy_skills (hh_id, skill_id) VALUES (%s, %s) ON CONFLICT (hh_id, skill_id) DO NOTHING",
-                            (hh_id, skill_id),
-                        )
-                        from_key_skills += 1
-                    except Exception:
-                        pass
-
-        # Этап 2: поиск по названию и описанию (сначала длинные фразы, чтобы не дублировать)
-        skill_names_sorted = sorted(name_to_id.keys(), key=len, reverse=True)
         from_text = 0
-        for hh_id, raw in raw_by_id.items():
-            text = _build_vacancy_text(raw)
-            if not text:
-                continue
-            for skill_name in skill_names_sorted:
-                if not _skill_matches_text(skill_name, text):
-                    continue
-                skill_id = name_to_id.get(skill_name)
-                if skill_id is None:
-                    continue
-                try:
-                    conn.execute(
-                        "INSERT INTO public.vacancy_skills (hh_id, skill_id) VALUES (%s, %s) ON CONFLICT (hh_id, skill_id) DO NOTHING",
-                        (hh_id, skill_id),
-                    )
-                    from_text += 1
-                except Exception:
-                    pass
+        for page_ids, links, n_key, n_text in shards:
+            from_key_skills += n_key
+            from_text += n_text
+            if links:
+                with conn.cursor() as cur:
+                    with cur.copy("COPY public.vacancy_skills (hh_id, skill_id) FROM STDIN") as copy:
+                        for row in links:
+                            copy.write_row(row)
+            conn.execute(
+                """
+                INSERT INTO public.vacancy_skills_state (hh_id, content_hash, processed_at)
+                SELECT t.hh_id, t.content_hash, NOW()
+                FROM unnest(%s::text[], %s::text[]) AS t(hh_id, content_hash)
+                ON CONFLICT (hh_id) DO UPDATE
+                SET content_hash = EXCLUDED.content_hash, processed_at = EXCLUDED.processed_at
+                """,
+                (page_ids, [hashes[i] for i in page_ids]),
+            )
 
         conn.commit()
-        return {
-            "skills_added": len(all_names),
-            "vacancy_skills_added": from_key_skills + from_text,
-            "vacancy_skills_from_key_skills": from_key_skills,
-            "vacancy_skills_from_text": from_text,
-            "vacancies_processed": len(rows),
-            "skills_total": len(name_to_id),
-        }
-    finally:
-        conn.close()
+    refresh_skill_stats()
+    return {
+        "skills_added": skills_added,
+        "vacancy_skills_added": from_key_skills + from_text,
+        "vacancy_skills_from_key_skills": from_key_skills,
+        "vacancy_skills_from_text": from_text,
+        "vacancies_processed": len(hashes),
+        "skills_total": len(name_to_id),
+        "full": full,
+    }
+
+
+# Материализованные представления статистики навыков (db/migrations/08_skill_stats_mv.sql)
+SKILL_STATS_VIEWS = ("skill_counts_mv", "skill_cooccurrence_mv", "skill_areas_mv")
+
+
+def refresh_skill_stats(views: Iterable[str] = SKILL_STATS_VIEWS) -> None:
+    """
+    Пересчитать статистику навыков. REFRESH ... CONCURRENTLY не блокирует чтение:
+    до окончания пересчёта GET /skills отдаёт прежние данные. Каждое представление —
+    в своей транзакции. views — подмножество SKILL_STATS_VIEWS (по умолчанию все).
+    """
+    for view in views:
+        with get_connection() as conn:
+            conn.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY public.{view}")
 
 
 def get_skills(limit: int = 200) -> list[dict[str, Any]]:
     """
-    Список навыков с количеством вакансий (топ по частоте).
+    Список навыков с количеством вакансий (топ по частоте) из public.skill_counts_mv.
     """
-    conn = get_connection_sync()
-    try:
+    with get_connection() as conn:
         cur = conn.execute(
             """
-            SELECT s.id, s.name, COUNT(vs.hh_id) AS vacancy_count
-            FROM public.skills s
-            LEFT JOIN public.vacancy_skills vs ON vs.skill_id = s.id
-            GROUP BY s.id, s.name
-            ORDER BY vacancy_count DESC, s.name
+            SELECT skill_id, name, vacancy_count
+            FROM public.skill_counts_mv
+            ORDER BY vacancy_count DESC, name
             LIMIT %s
             """,
             (limit,),
@@ -273,5 +449,65 @@ def get_skills(limit: int = 200) -> list[dict[str, Any]]:
             {"id": r[0], "name": r[1], "vacancy_count": r[2]}
             for r in rows
         ]
-    finally:
-        conn.close()
+
+
+def get_skill_cooccurrence(skill: str | None = None, limit: int = 50) -> list[dict[str, Any]]:
+    """
+    Навыки, встречающиеся вместе: для заданного навыка — его «соседи» по частоте,
+    без навыка — самые частые пары (каждая пара один раз).
+    """
+    with get_connection() as conn:
+        if skill:
+            cur = conn.execute(
+                """
+                SELECT s.name, o.name, c.vacancy_count
+                FROM public.skills s
+                JOIN public.skill_cooccurrence_mv c ON c.skill_id = s.id
+                JOIN public.skills o ON o.id = c.other_skill_id
+                WHERE s.name = %s
+                ORDER BY c.vacancy_count DESC, o.name
+                LIMIT %s
+                """,
+                (normalize_skill_name(skill), limit),
+            )
+        else:
+            cur = conn.execute(
+                """
+                SELECT s.name, o.name, c.vacancy_count
+                FROM public.skill_cooccurrence_mv c
+                JOIN public.skills s ON s.id = c.skill_id
+                JOIN public.skills o ON o.id = c.other_skill_id
+                WHERE c.skill_id < c.other_skill_id
+                ORDER BY c.vacancy_count DESC, s.name, o.name
+                LIMIT %s
+                """,
+                (limit,),
+            )
+        return [
+            {"skill": r[0], "other_skill": r[1], "vacancy_count": r[2]}
+            for r in cur.fetchall()
+        ]
+
+
+def get_skill_areas(skill: str | None = None, limit: int = 50) -> list[dict[str, Any]]:
+    """
+    Разбивка навыков по регионам: для заданного навыка — регионы по числу вакансий,
+    без навыка — самые частые пары навык — регион.
+    """
+    name = normalize_skill_name(skill) if skill else None
+    with get_connection() as conn:
+        cur = conn.execute(
+            """
+            SELECT s.name, a.area_name, a.vacancy_count
+            FROM public.skill_areas_mv a
+            JOIN public.skills s ON s.id = a.skill_id
+            WHERE %s::text IS NULL OR s.name = %s
+            ORDER BY a.vacancy_count DESC, s.name, a.area_name
+            LIMIT %s
+            """,
+            (name, name, limit),
+        )
+        return [
+            {"skill": r[0], "area": r[1] or None, "vacancy_count": r[2]}
+            for r in cur.fetchall()
+        ]
@@ -1,23 +1,30 @@
 """
 Сохранение вакансий и эмбеддингов в PostgreSQL (pgvector).
 """
+import hashlib
 import json
-import time
+import threading
 from datetime import datetime
 from typing import Any
 
+import numpy as np
 import psycopg
-from pgvector.psycopg import register_vector
+from psycopg.types.json import Jsonb
 
-from app.db import get_connection_sync, list_to_pgvector
-from app.embeddings import embed_batch
+from app.ann_index import ann_settings
+from app.cache import SearchCache, get_search_cache, invalidate_search_cache
+from app.config import settings
+from app.db import get_async_connection, get_connection, stream_query
+from app.embeddings import embed_batch_array, fit_token_budget
 from app.hh_client import (
     PER_PAGE_MAX,
-    fetch_vacancy_detail,
+    fetch_vacancy_details,
     fetch_vacancies,
     strip_html,
     vacancy_to_text,
 )
+from app.pipeline import Pipeline, Stage
+from app.skills import refresh_skill_stats
 
 
 def parse_date(s: str | None) -> datetime | None:
@@ -29,96 +36,110 @@ def parse_date(s: str | None) -> datetime | None:
         return None
 
 
-def upsert_raw_vacancy(conn: psycopg.Connection, hh_id: str, raw_json: dict[str, Any]) -> None:
-    """Сохранить сырой ответ API hh.ru в public.raw_vacancies (этап 1 — только выгрузка)."""
-    raw_str = json.dumps(raw_json, ensure_ascii=False, default=str)
+def _dump_json(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False, default=str)
+
+
+def copy_raw_vacancies(conn: psycopg.Connection, items: list[tuple[str, dict[str, Any]]]) -> int:
+    """
+    Пакетная запись сырых вакансий: binary COPY во временную таблицу и один
+    INSERT ... ON CONFLICT в public.raw_vacancies. Возвращает число записанных строк.
+    """
+    if not items:
+        return 0
     conn.execute(
         """
-        INSERT INTO public.raw_vacancies (hh_id, raw_json)
-        VALUES (%s, %s::jsonb)
-        ON CONFLICT (hh_id) DO UPDATE SET raw_json = EXCLUDED.raw_json
-        """,
-        (hh_id, raw_str),
+        CREATE TEMP TABLE IF NOT EXISTS raw_vacancies_stage (
+            hh_id VARCHAR(32), raw_json JSONB
+        ) ON COMMIT DELETE ROWS
+        """
     )
+    with conn.cursor() as cur:
+        with cur.copy("COPY raw_vacancies_stage (hh_id, raw_json) FROM STDIN (FORMAT BINARY)") as copy:
+            copy.set_types(["varchar", "jsonb"])
+            for hh_id, raw_json in items:
+                copy.write_row((hh_id, Jsonb(raw_json, dumps=_dump_json)))
+        cur.execute(
+            """
+            INSERT INTO public.raw_vacancies (hh_id, raw_json)
+            SELECT DISTINCT ON (hh_id) hh_id, raw_json FROM raw_vacancies_stage
+            ON CONFLICT (hh_id) DO UPDATE SET raw_json = EXCLUDED.raw_json
+            """
+        )
+        return cur.rowcount
 
 
-def upsert_rag_vacancy(
-    conn: psycopg.Connection,
-    hh_id: str,
-    name: str,
-    description: str | None,
-    employer_name: str | None,
-    area_name: str | None,
-    salary_from: int | None,
-    salary_to: int | None,
-    url: str | None,
-    published_at: datetime | None,
-    embedding: list[float],
-) -> None:
-    """Записать вакансию с эмбеддингом в public.rag_vacancies (этап 2 — после преобразований)."""
+_RAG_COLUMNS = (
+    "hh_id", "name", "description", "employer_name", "area_name",
+    "salary_from", "salary_to", "url", "published_at", "key_skills", "embedding", "content_hash",
+)
+_RAG_COPY_TYPES = [
+    "varchar", "text", "text", "text", "text",
+    "int4", "int4", "text", "timestamptz", "text", "vector", "varchar",
+]
+
+
+def copy_rag_vacancies(conn: psycopg.Connection, records: list[dict[str, Any]], embeddings: np.ndarray) -> int:
+    """
+    Пакетная запись этапа 2: binary COPY во временную таблицу (векторы — в бинарном формате
+    pgvector прямо из NumPy, без JSON и ::vector) и один INSERT ... ON CONFLICT в public.rag_vacancies.
+    records — словари из _prepare_rag_record, embeddings — матрица в том же порядке.
+    """
+    if not records:
+        return 0
+    columns = ", ".join(_RAG_COLUMNS)
     conn.execute(
         """
-        INSERT INTO public.rag_vacancies (
-            hh_id, name, description, employer_name, area_name,
-            salary_from, salary_to, url, published_at, embedding
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s::vector)
-        ON CONFLICT (hh_id) DO UPDATE SET
-            name = EXCLUDED.name,
-            description = EXCLUDED.description,
-            employer_name = EXCLUDED.employer_name,
-            area_name = EXCLUDED.area_name,
-            salary_from = EXCLUDED.salary_from,
-            salary_to = EXCLUDED.salary_to,
-            url = EXCLUDED.url,
-            published_at = EXCLUDED.published_at,
-            embedding = EXCLUDED.embedding
-        """,
-        (
-            hh_id,
-            name,
-            description,
-            employer_name,
-            area_name,
-            salary_from,
-            salary_to,
-            url,
-            published_at,
-            list_to_pgvector(embedding),
-        ),
+        CREATE TEMP TABLE IF NOT EXISTS rag_vacancies_stage (
+            hh_id VARCHAR(32), name TEXT, description TEXT, employer_name TEXT, area_name TEXT,
+            salary_from INTEGER, salary_to INTEGER, url TEXT, published_at TIMESTAMPTZ,
+            key_skills TEXT, embedding vector, content_hash VARCHAR(40)
+        ) ON COMMIT DELETE ROWS
+        """
     )
+    updates = ",\n                ".join(f"{c} = EXCLUDED.{c}" for c in _RAG_COLUMNS[1:])
+    with conn.cursor() as cur:
+        with cur.copy(f"COPY rag_vacancies_stage ({columns}) FROM STDIN (FORMAT BINARY)") as copy:
+            copy.set_types(_RAG_COPY_TYPES)
+            for r, emb in zip(records, embeddings):
+                copy.write_row((*(r[c] for c in _RAG_COLUMNS[:-2]), emb, r["content_hash"]))
+        cur.execute(
+            f"""
+            INSERT INTO public.rag_vacancies ({columns})
+            SELECT DISTINCT ON (hh_id) {columns} FROM rag_vacancies_stage
+            ON CONFLICT (hh_id) DO UPDATE SET
+                {updates}
+            """
+        )
+        written = cur.rowcount
+        # Сбор навыков читает очищенное описание из rag_vacancies: перезаписанные вакансии
+        # попадут в следующий collect_skills_from_raw как изменившиеся
+        cur.execute(
+            "DELETE FROM public.vacancy_skills_state s USING rag_vacancies_stage t WHERE s.hh_id = t.hh_id"
+        )
+        return written
 
 
 def load_and_index_vacancies(
     search_query: str = "python",
     max_vacancies: int = 50,
-    detail_delay_sec: float = 1.2,
+    detail_delay_sec: float | None = None,
+    delta: bool = True,
 ) -> int:
     """
     Этап 1: выгрузить вакансии с hh.ru в public.raw_vacancies (только id + json).
     Эмбеддинги и rag_vacancies — отдельно, через process_raw_to_rag() или POST /ingest/embed.
+    delta: запрашивать детали только для новых и изменившихся вакансий (changed_vacancy_ids).
     """
     items = fetch_vacancies(text=search_query, per_page=PER_PAGE_MAX, max_pages=5)
     if not items:
         return 0
 
-    to_process = items[:max_vacancies]
-    conn = get_connection_sync()
-    try:
-        saved = 0
-        for i, it in enumerate(to_process):
-            if i > 0:
-                time.sleep(detail_delay_sec)
-            try:
-                full = fetch_vacancy_detail(it["id"])
-                if full:
-                    upsert_raw_vacancy(conn, str(full["id"]), full)
-                    saved += 1
-            except Exception:
-                continue
-        conn.commit()
-        return saved
-    finally:
-        conn.close()
+    items = items[:max_vacancies]
+    to_process = filter_new_or_changed(items) if delta else [str(it["id"]) for it in items]
+    if not to_process:
+        return 0
+    return _load_details(to_process, detail_delay_sec=detail_delay_sec)
 
 
 # Ключевые слова для поиска вакансий Data Engineer (рус + англ)
@@ -135,10 +156,83 @@ DEFAULT_DATA_ENGINEER_QUERIES = [
 ]
 
 
-def _chunks(lst: list[Any], size: int):
-    """Разбить список на чанки заданного размера."""
-    for i in range(0, len(lst), size):
-        yield lst[i : i + size]
+def existing_raw_ids(conn: psycopg.Connection, hh_ids: list[str]) -> set[str]:
+    """Какие из hh_ids уже есть в public.raw_vacancies (один запрос = ANY)."""
+    if not hh_ids:
+        return set()
+    cur = conn.execute("SELECT hh_id FROM public.raw_vacancies WHERE hh_id = ANY(%s)", (hh_ids,))
+    return {r[0] for r in cur.fetchall()}
+
+
+def _skip_existing(hh_ids: list[str]) -> list[str]:
+    with get_connection() as conn:
+        existing = existing_raw_ids(conn, hh_ids)
+    return [vid for vid in hh_ids if vid not in existing]
+
+
+# Поля краткой карточки из поиска (GET /vacancies), по которым видно, что вакансия изменилась
+LISTING_CHANGE_FIELDS = ("published_at", "updated_at")
+
+
+def changed_vacancy_ids(conn: psycopg.Connection, items: list[dict[str, Any]]) -> list[str]:
+    """
+    Delta-выгрузка: из кратких карточек поиска оставить id новых вакансий и тех, у которых
+    published_at/updated_at в выдаче отличается от сохранённого в raw_vacancies.
+    Один запрос = ANY(%s), из JSONB читаются только сравниваемые поля. Порядок — как в items.
+    """
+    by_id: dict[str, dict[str, Any]] = {}
+    for it in items:
+        vid = str(it.get("id") or "")
+        if vid and vid not in by_id:
+            by_id[vid] = it
+    if not by_id:
+        return []
+    fields = ", ".join(f"raw_json->>'{f}'" for f in LISTING_CHANGE_FIELDS)
+    cur = conn.execute(
+        f"SELECT hh_id, {fields} FROM public.raw_vacancies WHERE hh_id = ANY(%s)",
+        (list(by_id),),
+    )
+    stored = {r[0]: r[1:] for r in cur.fetchall()}
+    result = []
+    for vid, it in by_id.items():
+        if vid not in stored:
+            result.append(vid)
+            continue
+        for field, value in zip(LISTING_CHANGE_FIELDS, stored[vid]):
+            if it.get(field) and parse_date(it[field]) != parse_date(value):
+                result.append(vid)
+                break
+    return result
+
+
+def filter_new_or_changed(items: list[dict[str, Any]]) -> list[str]:
+    """changed_vacancy_ids на соединении из пула (для скриптов и ингеста)."""
+    with get_connection() as conn:
+        return changed_vacancy_ids(conn, items)
+
+
+def _save_raw_chunk(details: list[dict[str, Any]]) -> None:
+    """Записать порцию деталей в raw_vacancies; соединение берётся из пула только на время записи."""
+    with get_connection() as conn:
+        copy_raw_vacancies(conn, [(str(full["id"]), full) for full in details])
+
+
+def _load_details(id_list: list[str], chunk_size: int = 100, detail_delay_sec: float | None = None) -> int:
+    """Загрузить детали в raw_vacancies; если что-то сохранено — обновить снимок статистики."""
+    saved = fetch_vacancy_details(
+        id_list,
+        _save_raw_chunk,
+        chunk_size=chunk_size,
+        max_rps=_max_rps(detail_delay_sec),
+    )
+    if saved:
+        refresh_stats_snapshot()
+    return saved
+
+
+def _max_rps(detail_delay_sec: float | None) -> float | None:
+    """Старый параметр паузы между запросами деталей -> верхняя граница RPS для лимитера (None — по лимитам hh.ru)."""
+    return 1.0 / detail_delay_sec if detail_delay_sec else None
 
 
 def load_and_index_vacancies_multi(
@@ -147,16 +241,20 @@ def load_and_index_vacancies_multi(
     per_page: int = PER_PAGE_MAX,
     max_pages_per_query: int = 5,
     search_field: str = "name",
-    detail_delay_sec: float = 2.0,
+    detail_delay_sec: float | None = None,
     chunk_size: int = 10,
+    delta: bool = True,
 ) -> int:
     """
     Этап 1: выгрузка по нескольким запросам в public.raw_vacancies (только id + json).
     Чанками: запрос N деталей → запись в raw. Эмбеддинги — отдельно (process_raw_to_rag).
+    delta: запрашивать детали только для новых вакансий и тех, у которых в выдаче поиска
+    изменились published_at/updated_at (changed_vacancy_ids).
+    Для долгих выгрузок с возобновлением после рестарта — app.jobs (POST /ingest/jobs).
     """
     queries = search_queries or DEFAULT_DATA_ENGINEER_QUERIES
     seen_ids: set[str] = set()
-    unique_ids: list[str] = []
+    unique_items: list[dict[str, Any]] = []
 
     for text in queries:
         items = fetch_vacancies(
@@ -169,220 +267,533 @@ def load_and_index_vacancies_multi(
             vid = str(it.get("id", ""))
             if vid and vid not in seen_ids:
                 seen_ids.add(vid)
-                unique_ids.append(vid)
-                if len(unique_ids) >= target_count:
+                unique_items.append(it)
+                if len(unique_items) >= target_count:
                     break
-        if len(unique_ids) >= target_count:
+        if len(unique_items) >= target_count:
             break
 
-    id_list = unique_ids[:target_count]
+    unique_items = unique_items[:target_count]
+    if delta:
+        id_list = filter_new_or_changed(unique_items)
+    else:
+        id_list = [str(it["id"]) for it in unique_items]
     if not id_list:
         return 0
 
-    total_saved = 0
-    conn = get_connection_sync()
-    try:
-        for id_chunk in _chunks(id_list, chunk_size):
-            for i, vid in enumerate(id_chunk):
-                if i > 0:
-                    time.sleep(detail_delay_sec)
-                try:
-                    full = fetch_vacancy_detail(vid)
-                    if full:
-                        upsert_raw_vacancy(conn, str(full["id"]), full)
-                        total_saved += 1
-                except Exception:
-                    continue
-            conn.commit()
-        return total_saved
-    finally:
-        conn.close()
+    return _load_details(id_list, chunk_size=chunk_size, detail_delay_sec=detail_delay_sec)
 
 
 def load_and_index_vacancy_ids(
     id_list: list[str],
     chunk_size: int = 10,
-    detail_delay_sec: float = 2.0,
+    detail_delay_sec: float | None = None,
+    skip_existing: bool = True,
 ) -> int:
     """
     Этап 1: по списку hh_id загрузить детали с API и сохранить в public.raw_vacancies.
     Эмбеддинги — отдельно (process_raw_to_rag).
+    skip_existing: не загружать детали вакансий, которые уже есть в raw_vacancies
+    (без данных выдачи поиска изменения не видны; если они есть — filter_new_or_changed).
     """
+    if skip_existing:
+        id_list = _skip_existing(id_list)
     if not id_list:
         return 0
-    total_saved = 0
-    conn = get_connection_sync()
-    try:
-        for id_chunk in _chunks(id_list, chunk_size):
-            for i, vid in enumerate(id_chunk):
-                if i > 0:
-                    time.sleep(detail_delay_sec)
-                try:
-                    full = fetch_vacancy_detail(vid)
-                    if full:
-                        upsert_raw_vacancy(conn, str(full["id"]), full)
-                        total_saved += 1
-                except Exception:
-                    continue
-            conn.commit()
-        return total_saved
-    finally:
-        conn.close()
+    return _load_details(id_list, chunk_size=chunk_size, detail_delay_sec=detail_delay_sec)
+
+
+# Поля raw_json, которые нужны этапу 2: читаются jsonb-операторами, остальной документ hh.ru
+# (брендированное описание, адрес, контакты, ...) из БД не передаётся и не разбирается.
+# Описание и скаляры — текстом (->>), без JSON-декодирования; key_skills и salary — jsonb
+_RAW_PROJECTION = """
+    r.raw_json->>'name', r.raw_json->>'description', r.raw_json->'key_skills', r.raw_json->'salary',
+    r.raw_json#>>'{area,name}', r.raw_json#>>'{employer,name}',
+    r.raw_json->>'alternate_url', r.raw_json->>'published_at'
+"""
+
+
+def _raw_from_projection(hh_id: str, values: tuple[Any, ...]) -> dict[str, Any]:
+    """Словарь в форме ответа API hh.ru из полей _RAW_PROJECTION (отсутствующие поля — без ключа)."""
+    name, description, key_skills, salary, area_name, employer_name, url, published_at = values
+    v: dict[str, Any] = {"id": hh_id}
+    for key, value in (
+        ("name", name),
+        ("description", description),
+        ("key_skills", key_skills),
+        ("salary", salary),
+        ("area", {"name": area_name} if area_name is not None else None),
+        ("employer", {"name": employer_name} if employer_name is not None else None),
+        ("alternate_url", url),
+        ("published_at", published_at),
+    ):
+        if value is not None:
+            v[key] = value
+    return v
+
+
+def _prepare_rag_record(v: dict[str, Any]) -> dict[str, Any]:
+    """
+    Поля строки rag_vacancies + текст для эмбеддинга и content_hash.
+    content_hash — sha1 от модели, текста для эмбеддинга и сохраняемых полей: если он совпадает
+    с уже записанным, вакансию не нужно ни эмбеддить заново, ни перезаписывать.
+    """
+    salary = v.get("salary")
+    area = v.get("area", {}) or {}
+    employer = v.get("employer", {}) or {}
+    # Описание очищается один раз: и для колонки description, и для текста эмбеддинга
+    description = strip_html(v.get("description"))
+    record = {
+        "hh_id": str(v["id"]),
+        "name": v.get("name", ""),
+        "description": description,
+        "employer_name": employer.get("name"),
+        "area_name": area.get("name"),
+        "salary_from": salary.get("from") if salary else None,
+        "salary_to": salary.get("to") if salary else None,
+        "url": v.get("alternate_url"),
+        "published_at": parse_date(v.get("published_at")),
+        # Для полнотекстового поиска (search_tsv): названия навыков через запятую
+        "key_skills": ", ".join(s["name"] for s in v.get("key_skills") or [] if s.get("name")) or None,
+    }
+    # Текст для эмбеддинга — в пределах бюджета токенов модели; правки в отброшенном хвосте
+    # описания не меняют content_hash и не вызывают пересчёт эмбеддинга
+    text, tokens = fit_token_budget(vacancy_to_text(v, description))
+    fingerprint = json.dumps(
+        [settings.embedding_model, text, record], ensure_ascii=False, sort_keys=True, default=str
+    )
+    record["content_hash"] = hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()
+    record["text"] = text
+    record["tokens"] = tokens
+    return record
+
+
+# Метрики последнего прогона этапа 2 (для /metrics)
+_last_pipeline_metrics: dict[str, Any] = {}
 
 
 def process_raw_to_rag(
     limit: int | None = None,
     chunk_size: int = 50,
-) -> int:
+    incremental: bool = True,
+) -> dict[str, Any]:
     """
     Этап 2: прочитать из public.raw_vacancies, преобразовать (strip_html, текст для эмбеддинга),
     посчитать эмбеддинги и записать в public.rag_vacancies.
+    Конвейер (app.pipeline): чтение страницами по chunk_size → подготовка текстов в
+    embed_pipeline_workers потоках → инференс (один поток) → пакетная запись; стадии работают
+    одновременно, модель не простаивает на чтении и записи. raw_vacancies читается потоково —
+    память не растёт с размером таблицы.
     limit: максимум строк из raw (None = все). chunk_size: пачка для embed_batch.
+    incremental: эмбеддить только новые и изменившиеся вакансии (сравнение content_hash);
+    False — пересчитать всё.
+    Возвращает счётчики processed (записано), skipped (без изменений), failed (ошибки разбора/записи)
+    и pipeline — время и загрузку каждой стадии.
     """
-    conn = get_connection_sync()
-    register_vector(conn)
-    try:
-        if limit is not None:
-            cur = conn.execute(
-                "SELECT hh_id, raw_json FROM public.raw_vacancies ORDER BY created_at LIMIT %s",
-                (limit,),
-            )
-        else:
-            cur = conn.execute("SELECT hh_id, raw_json FROM public.raw_vacancies ORDER BY created_at")
-        rows = cur.fetchall()
-    finally:
-        conn.close()
+    counts = {"processed": 0, "skipped": 0, "failed": 0}
+    lock = threading.Lock()
 
-    if not rows:
-        return 0
+    def count(key: str, n: int) -> None:
+        with lock:
+            counts[key] += n
 
-    total = 0
-    conn = get_connection_sync()
-    register_vector(conn)
-    try:
-        for chunk in _chunks(rows, chunk_size):
-            vacancies_data: list[dict[str, Any]] = []
-            for _hh_id, raw_json in chunk:
-                v = json.loads(raw_json) if isinstance(raw_json, str) else raw_json
-                if isinstance(v, dict):
-                    vacancies_data.append(v)
-
-            if not vacancies_data:
+    # Записанный content_hash читается вместе с raw одним запросом — без отдельного запроса на пачку
+    query = (
+        f"SELECT r.hh_id, g.content_hash, {_RAW_PROJECTION} FROM public.raw_vacancies r "
+        "LEFT JOIN public.rag_vacancies g ON g.hh_id = r.hh_id ORDER BY r.created_at"
+    )
+    params: tuple[Any, ...] | None = None
+    if limit is not None:
+        query += " LIMIT %s"
+        params = (limit,)
+
+    def prepare(chunk: list[tuple[Any, ...]]) -> list[dict[str, Any]] | None:
+        records: list[dict[str, Any]] = []
+        for hh_id, existing_hash, *fields in chunk:
+            try:
+                record = _prepare_rag_record(_raw_from_projection(hh_id, tuple(fields)))
+            except Exception:
+                count("failed", 1)
+                continue
+            if incremental and existing_hash == record["content_hash"]:
+                count("skipped", 1)
                 continue
+            records.append(record)
+        return records or None
 
-            texts = [vacancy_to_text(v) for v in vacancies_data]
-            embeddings = embed_batch(texts)
-            for v, emb in zip(vacancies_data, embeddings):
-                salary = v.get("salary")
-                area = v.get("area", {}) or {}
-                employer = v.get("employer", {}) or {}
-                upsert_rag_vacancy(
-                    conn=conn,
-                    hh_id=str(v["id"]),
-                    name=v.get("name", ""),
-                    description=strip_html(v.get("description")),
-                    employer_name=employer.get("name"),
-                    area_name=area.get("name"),
-                    salary_from=salary.get("salary_from") if salary else None,
-                    salary_to=salary.get("salary_to") if salary else None,
-                    url=v.get("alternate_url"),
-                    published_at=parse_date(v.get("published_at")),
-                    embedding=emb,
-                )
-            conn.commit()
-            total += len(vacancies_data)
-        return total
-    finally:
-        conn.close()
+    def embed(records: list[dict[str, Any]]) -> tuple[list[dict[str, Any]], np.ndarray] | None:
+        try:
+            embeddings = embed_batch_array(
+                [r["text"] for r in records], lengths=[r["tokens"] for r in records]
+            )
+        except Exception:
+            count("failed", len(records))
+            return None
+        return records, embeddings
+
+    def write(batch: tuple[list[dict[str, Any]], np.ndarray]) -> None:
+        records, embeddings = batch
+        try:
+            with get_connection() as conn:
+                copy_rag_vacancies(conn, records, embeddings)
+            count("processed", len(records))
+        except Exception:
+            count("failed", len(records))
+
+    pipeline = Pipeline(
+        stream_query(query, params, page_size=chunk_size),
+        [
+            Stage("preprocess", prepare, workers=settings.embed_pipeline_workers),
+            Stage("embed", embed),
+            Stage("write", write),
+        ],
+        queue_size=settings.embed_pipeline_queue_size,
+    )
+    pipeline.run()
+    _last_pipeline_metrics.update(pipeline.metrics())
+    if counts["processed"]:
+        invalidate_search_cache()
+        refresh_stats_snapshot()
+        # Регион вакансии для skill_areas_mv берётся из rag_vacancies
+        refresh_skill_stats(("skill_areas_mv",))
+    return {**counts, "pipeline": pipeline.metrics()}
 
 
-def get_stats() -> dict[str, Any]:
-    """Агрегатная статистика по вакансиям для дашборда (из public.rag_vacancies)."""
-    conn = get_connection_sync()
-    try:
-        cur = conn.execute("SELECT COUNT(*) FROM public.rag_vacancies")
-        total_vacancies = cur.fetchone()[0] or 0
+def get_pipeline_metrics() -> dict[str, Any]:
+    """Время, пропускная способность и загрузка стадий последнего process_raw_to_rag."""
+    return dict(_last_pipeline_metrics)
 
-        cur = conn.execute(
-            "SELECT COUNT(DISTINCT employer_name) FROM public.rag_vacancies WHERE employer_name IS NOT NULL AND employer_name != ''"
-        )
-        unique_employers = cur.fetchone()[0] or 0
 
+def _compute_stats(conn: psycopg.Connection) -> dict[str, Any]:
+    """Агрегаты для дашборда (полные проходы по rag_vacancies и raw_vacancies)."""
+    cur = conn.execute(
+        """
+        SELECT
+            COUNT(*),
+            COUNT(DISTINCT employer_name) FILTER (WHERE employer_name IS NOT NULL AND employer_name != ''),
+            COUNT(*) FILTER (WHERE salary_from IS NOT NULL OR salary_to IS NOT NULL),
+            AVG(salary_from) FILTER (WHERE salary_from IS NOT NULL),
+            AVG(salary_to) FILTER (WHERE salary_from IS NOT NULL)
+        FROM public.rag_vacancies
+        """
+    )
+    total_vacancies, unique_employers, with_salary, avg_from, avg_to = cur.fetchone()
+
+    cur = conn.execute(
+        """
+        SELECT area_name, COUNT(*) AS cnt FROM public.rag_vacancies
+        WHERE area_name IS NOT NULL AND area_name != ''
+        GROUP BY area_name ORDER BY cnt DESC LIMIT 10
+        """
+    )
+    top_areas = [{"name": r[0], "count": r[1]} for r in cur.fetchall()]
+
+    cur = conn.execute("SELECT COUNT(*) FROM public.raw_vacancies")
+    raw_count = cur.fetchone()[0] or 0
+
+    return {
+        "total_vacancies": total_vacancies or 0,
+        "unique_employers": unique_employers or 0,
+        "top_areas": top_areas,
+        "vacancies_with_salary": with_salary or 0,
+        "avg_salary_from": round(float(avg_from), 0) if avg_from is not None else None,
+        "avg_salary_to": round(float(avg_to), 0) if avg_to is not None else None,
+        "raw_vacancies_count": raw_count,
+    }
+
+
+def refresh_stats_snapshot() -> dict[str, Any]:
+    """
+    Пересчитать статистику и сохранить в public.stats_snapshot (одна строка).
+    Вызывается после записи на этапах 1 и 2; GET /stats читает готовый снимок.
+    """
+    with get_connection() as conn:
+        data = _compute_stats(conn)
         cur = conn.execute(
             """
-            SELECT area_name, COUNT(*) AS cnt FROM public.rag_vacancies
-            WHERE area_name IS NOT NULL AND area_name != ''
-            GROUP BY area_name ORDER BY cnt DESC LIMIT 10
-            """
+            INSERT INTO public.stats_snapshot (id, data, computed_at) VALUES (1, %s, NOW())
+            ON CONFLICT (id) DO UPDATE SET data = EXCLUDED.data, computed_at = EXCLUDED.computed_at
+            RETURNING computed_at
+            """,
+            (Jsonb(data),),
         )
-        top_areas = [{"name": r[0], "count": r[1]} for r in cur.fetchall()]
+        return {**data, "computed_at": cur.fetchone()[0]}
 
-        cur = conn.execute(
-            "SELECT COUNT(*) FROM public.rag_vacancies WHERE salary_from IS NOT NULL OR salary_to IS NOT NULL"
-        )
-        with_salary = cur.fetchone()[0] or 0
 
-        cur = conn.execute(
-            "SELECT AVG(salary_from), AVG(salary_to) FROM public.rag_vacancies WHERE salary_from IS NOT NULL"
+def get_stats(fresh: bool = False) -> dict[str, Any]:
+    """
+    Агрегатная статистика по вакансиям для дашборда: снимок из public.stats_snapshot
+    с временем расчёта computed_at. fresh=True (или снимка ещё нет) — пересчитать сейчас.
+    """
+    if not fresh:
+        with get_connection() as conn:
+            cur = conn.execute("SELECT data, computed_at FROM public.stats_snapshot WHERE id = 1")
+            row = cur.fetchone()
+        if row is not None:
+            return {**row[0], "computed_at": row[1]}
+    return refresh_stats_snapshot()
+
+
+# Вектор запроса передаётся один раз в бинарном формате pgvector (%(vec)b), расстояние считается
+# один раз и используется для сортировки; similarity = 1 - distance считается в Python.
+# Описание обрезается на стороне БД (left), чтобы не передавать полный текст.
+_SEARCH_SQL = """
+    SELECT hh_id, name, left(description, 500), employer_name, area_name,
+           salary_from, salary_to, url,
+           embedding <=> %(vec)b AS distance
+    FROM public.rag_vacancies
+    {where}
+    ORDER BY distance
+    LIMIT %(limit)s
+"""
+
+# Гибридный поиск: кандидаты из ANN-индекса и из полнотекстового (GIN по search_tsv, russian + english)
+# за один запрос, слияние по Reciprocal Rank Fusion: score = Σ 1 / (k + rank)
+_HYBRID_SQL = """
+    WITH semantic AS (
+        SELECT id, ROW_NUMBER() OVER (ORDER BY distance) AS rank
+        FROM (
+            SELECT id, embedding <=> %(vec)b AS distance
+            FROM public.rag_vacancies
+            {where}
+            ORDER BY distance
+            LIMIT %(candidates)s
+        ) s
+    ),
+    lexical AS (
+        SELECT id, ROW_NUMBER() OVER (ORDER BY text_rank DESC) AS rank
+        FROM (
+            SELECT id, ts_rank_cd(search_tsv, tsq) AS text_rank
+            FROM public.rag_vacancies,
+                 (SELECT websearch_to_tsquery('russian', %(text)s)
+                         || websearch_to_tsquery('english', %(text)s) AS tsq) q
+            WHERE search_tsv @@ tsq{and_where}
+            ORDER BY text_rank DESC
+            LIMIT %(candidates)s
+        ) l
+    )
+    SELECT r.hh_id, r.name, left(r.description, 500), r.employer_name, r.area_name,
+           r.salary_from, r.salary_to, r.url,
+           r.embedding <=> %(vec)b AS distance,
+           COALESCE(1.0 / (%(rrf_k)s + s.rank), 0) + COALESCE(1.0 / (%(rrf_k)s + l.rank), 0) AS score
+    FROM semantic s
+    FULL OUTER JOIN lexical l ON l.id = s.id
+    JOIN public.rag_vacancies r ON r.id = COALESCE(s.id, l.id)
+    ORDER BY score DESC
+    LIMIT %(limit)s
+"""
+
+# Фильтры поиска (/search, /rag) → условия по колонкам rag_vacancies (под каждое есть B-tree индекс)
+SEARCH_FILTERS = ("area", "employer", "salary_min", "salary_max", "published_after")
+SEARCH_MODES = ("semantic", "hybrid")
+
+
+def _search_where(filters: dict[str, Any] | None) -> tuple[list[str], dict[str, Any]]:
+    """Условия WHERE и их именованные параметры; пустые фильтры пропускаются."""
+    filters = {k: v for k, v in (filters or {}).items() if k in SEARCH_FILTERS and v is not None and v != ""}
+    clauses: list[str] = []
+    if "area" in filters:
+        clauses.append("area_name = %(area)s")
+    if "employer" in filters:
+        clauses.append("employer_name = %(employer)s")
+    if "salary_min" in filters:
+        # Вилка зарплаты пересекается с [salary_min, ∞): OR по двум индексам (BitmapOr)
+        clauses.append("(salary_to >= %(salary_min)s OR salary_from >= %(salary_min)s)")
+    if "salary_max" in filters:
+        clauses.append("salary_from <= %(salary_max)s")
+    if "published_after" in filters:
+        clauses.append("published_at >= %(published_after)s")
+    return clauses, filters
+
+
+def _vector_param(vec: list[float]) -> np.ndarray:
+    """Вектор запроса для %b-параметра: дампер pgvector передаёт float32 в бинарном формате."""
+    return np.asarray(vec, dtype=np.float32)
+
+
+def _search_query(
+    query: str,
+    query_vec: list[float],
+    limit: int,
+    filters: dict[str, Any] | None,
+    mode: str = "semantic",
+) -> tuple[str, dict[str, Any], bool]:
+    """SQL поиска, параметры и признак «есть фильтры» (для iterative scan)."""
+    clauses, params = _search_where(filters)
+    params.update(vec=_vector_param(query_vec), limit=limit)
+    where = "WHERE " + " AND ".join(clauses) if clauses else ""
+    if mode == "hybrid":
+        params.update(
+            text=query,
+            candidates=max(limit, settings.search_hybrid_candidates),
+            rrf_k=settings.search_rrf_k,
         )
-        row = cur.fetchone()
-        avg_salary_from = round(row[0], 0) if row and row[0] is not None else None
-        avg_salary_to = round(row[1], 0) if row and row[1] is not None else None
-
-        cur = conn.execute("SELECT COUNT(*) FROM public.raw_vacancies")
-        raw_count = cur.fetchone()[0] or 0
-
-        return {
-            "total_vacancies": total_vacancies,
-            "unique_employers": unique_employers,
-            "top_areas": top_areas,
-            "vacancies_with_salary": with_salary,
-            "avg_salary_from": avg_salary_from,
-            "avg_salary_to": avg_salary_to,
-            "raw_vacancies_count": raw_count,
-        }
-    finally:
-        conn.close()
+        and_where = "".join(f" AND {c}" for c in clauses)
+        return _HYBRID_SQL.format(where=where, and_where=and_where), params, bool(clauses)
+    return _SEARCH_SQL.format(where=where), params, bool(clauses)
+
+
+def _search_results(rows: list[tuple]) -> list[dict[str, Any]]:
+    # iterative scan в режиме relaxed_order может вернуть строки не строго по расстоянию;
+    # гибридный поиск уже отсортирован по score
+    results = [_search_row_to_dict(r) for r in rows]
+    results.sort(key=lambda r: r.get("score", r["similarity"]), reverse=True)
+    return results
+
+
+def _search_row_to_dict(r: tuple) -> dict[str, Any]:
+    result = {
+        "hh_id": r[0],
+        "name": r[1],
+        "description": r[2] or "",
+        "employer_name": r[3],
+        "area_name": r[4],
+        "salary_from": r[5],
+        "salary_to": r[6],
+        "url": r[7],
+        "similarity": round(1 - float(r[8]), 4),
+    }
+    if len(r) > 9:
+        result["score"] = round(float(r[9]), 6)
+    return result
 
 
 def search_similar(
     query: str,
     limit: int = 10,
+    ef_search: int | None = None,
+    probes: int | None = None,
+    filters: dict[str, Any] | None = None,
+    mode: str = "semantic",
 ) -> list[dict[str, Any]]:
     """
     Векторный поиск: эмбеддинг запроса и поиск ближайших вакансий (cosine).
+    ef_search / probes — точность ANN-индекса (HNSW / IVFFlat) для этого запроса; по умолчанию из настроек.
+    filters — ключи SEARCH_FILTERS (регион, работодатель, зарплата, дата публикации).
+    mode="hybrid" — ANN + полнотекстовый поиск со слиянием по RRF (в результатах поле score).
     """
     from app.embeddings import embed
 
     query_vec = embed(query)
-    conn = get_connection_sync()
-    register_vector(conn)
-    try:
-        cur = conn.execute(
-            """
-            SELECT hh_id, name, description, employer_name, area_name,
-                   salary_from, salary_to, url,
-                   1 - (embedding <=> %s::vector) AS similarity
-            FROM public.rag_vacancies
-            ORDER BY embedding <=> %s::vector
-            LIMIT %s
-            """,
-            (list_to_pgvector(query_vec), list_to_pgvector(query_vec), limit),
+    sql, params, filtered = _search_query(query, query_vec, limit, filters, mode)
+    with get_connection() as conn, conn.pipeline():
+        conn.execute(
+            *ann_settings(ef_search, probes, iterative=filtered, rows=params.get("candidates", limit)), prepare=True
         )
-        rows = cur.fetchall()
-        return [
-            {
-                "hh_id": r[0],
-                "name": r[1],
-                "description": (r[2] or "")[:500],
-                "employer_name": r[3],
-                "area_name": r[4],
-                "salary_from": r[5],
-                "salary_to": r[6],
-                "url": r[7],
-                "similarity": round(float(r[8]), 4),
-            }
-            for r in rows
-        ]
-    finally:
-        conn.close()
+        cur = conn.execute(sql, params, prepare=True)
+        return _search_results(cur.fetchall())
+
+
+async def search_similar_async(
+    query: str,
+    limit: int = 10,
+    ef_search: int | None = None,
+    probes: int | None = None,
+    filters: dict[str, Any] | None = None,
+    mode: str = "semantic",
+) -> list[dict[str, Any]]:
+    """
+    Асинхронный search_similar: инференс — в отдельном пуле (embed_async),
+    запрос к БД — через асинхронный пул соединений. Формат результата тот же.
+    Перед моделью и БД — кэш эмбеддингов запросов и результатов (app.cache).
+    """
+    from app.embeddings import embed_async
+
+    cache = get_search_cache() if settings.cache_enabled else None
+    key = SearchCache.result_key(query, limit, ef_search=ef_search, probes=probes, filters=filters, mode=mode)
+    if cache is not None:
+        cached, generation = await cache.get_results(key)
+        if cached is not None:
+            return cached
+
+    query_vec = await cache.get_embedding(query) if cache is not None else None
+    if query_vec is None:
+        query_vec = await embed_async(query)
+        if cache is not None:
+            await cache.set_embedding(query, query_vec)
+
+    sql, params, filtered = _search_query(query, query_vec, limit, filters, mode)
+    # Параметры ANN и сам поиск уходят в БД одним пакетом (pipeline), поиск — подготовленным запросом
+    async with get_async_connection() as conn, conn.pipeline():
+        await conn.execute(
+            *ann_settings(ef_search, probes, iterative=filtered, rows=params.get("candidates", limit)), prepare=True
+        )
+        cur = await conn.execute(sql, params, prepare=True)
+        results = _search_results(await cur.fetchall())
+    if cache is not None:
+        await cache.set_results(key, results, generation)
+    return results
+
+
+# Пакетный поиск: векторы всех запросов — одним массивом, ANN-поиск для каждого — LATERAL-подзапросом
+# (с теми же фильтрами, что у /search, внутри подзапроса)
+_BATCH_SEARCH_SQL = """
+    SELECT q.ord, r.hh_id, r.name, r.description, r.employer_name, r.area_name,
+           r.salary_from, r.salary_to, r.url, r.distance
+    FROM unnest(%(vecs)b) WITH ORDINALITY AS q(vec, ord)
+    CROSS JOIN LATERAL (
+        SELECT hh_id, name, left(description, 500) AS description, employer_name, area_name,
+               salary_from, salary_to, url,
+               embedding <=> q.vec AS distance
+        FROM public.rag_vacancies
+        {where}
+        ORDER BY distance
+        LIMIT %(limit)s
+    ) r
+    ORDER BY q.ord, r.distance
+"""
+
+
+async def search_similar_batch_async(
+    queries: list[str],
+    limit: int = 10,
+    ef_search: int | None = None,
+    probes: int | None = None,
+    filters: dict[str, Any] | None = None,
+    mode: str = "semantic",
+) -> dict[str, list[dict[str, Any]]]:
+    """
+    Поиск по многим запросам сразу: эмбеддинги запросов, которых нет в кэше, — через
+    EmbeddingBatcher (с его лимитом очереди: при перегрузке — EmbeddingOverloaded).
+    semantic: поиск ближайших для всех запросов — одним SQL-запросом; hybrid — по запросу
+    гибридного поиска на каждый, одним пакетом (pipeline). filters — как у search_similar.
+    Возвращает {запрос: результаты в формате search_similar}; повторы запросов схлопываются,
+    пустым запросам соответствует пустой список.
+    """
+    from app.embeddings import embed_batch_async
+
+    results: dict[str, list[dict[str, Any]]] = {q: [] for q in queries}
+    unique = [q for q in results if q.strip()]
+    if not unique:
+        return results
+    cache = get_search_cache() if settings.cache_enabled else None
+    vecs: dict[str, list[float] | None] = {
+        q: (await cache.get_embedding(q) if cache is not None else None) for q in unique
+    }
+    missing = [q for q, vec in vecs.items() if vec is None]
+    for q, vec in zip(missing, await embed_batch_async(missing)):
+        vecs[q] = vec
+        if cache is not None:
+            await cache.set_embedding(q, vec)
+
+    async with get_async_connection() as conn, conn.pipeline():
+        if mode == "hybrid":
+            cursors = []
+            for q in unique:
+                sql, params, filtered = _search_query(q, vecs[q], limit, filters, mode)
+                await conn.execute(
+                    *ann_settings(ef_search, probes, iterative=filtered, rows=params["candidates"]), prepare=True
+                )
+                cursors.append((q, await conn.execute(sql, params, prepare=True)))
+            for q, cur in cursors:
+                results[q] = _search_results(await cur.fetchall())
+            return results
+
+        clauses, params = _search_where(filters)
+        params.update(vecs=[_vector_param(vecs[q]) for q in unique], limit=limit)
+        where = "WHERE " + " AND ".join(clauses) if clauses else ""
+        await conn.execute(*ann_settings(ef_search, probes, iterative=bool(clauses), rows=limit), prepare=True)
+        cur = await conn.execute(_BATCH_SEARCH_SQL.format(where=where), params, prepare=True)
+        for row in await cur.fetchall():
+            results[unique[row[0] - 1]].append(_search_row_to_dict(row[1:]))
+    return results
@@ -22,11 +22,32 @@ CREATE TABLE IF NOT EXISTS public.rag_vacancies (
     url TEXT,
     published_at TIMESTAMPTZ,
     created_at TIMESTAMPTZ DEFAULT NOW(),
-    embedding vector(384)  -- MiniLM-L12 = 384 dimensions
+    embedding vector(384),  -- MiniLM-L12 = 384 dimensions
+    content_hash VARCHAR(40),  -- sha1 содержимого, по которому построен эмбеддинг (инкрементальный этап 2)
+    key_skills TEXT,  -- названия key_skills через запятую
+    -- Полнотекстовый вектор для гибридного поиска: название (A), навыки (B), описание (C); russian + english
+    search_tsv tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(key_skills, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(key_skills, '')), 'B') ||
+        setweight(to_tsvector('russian', coalesce(description, '')), 'C') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'C')
+    ) STORED
 );
+-- HNSW строится инкрементально и не зависит от объёма данных на момент создания (в отличие от IVFFlat);
+-- пересборка с другими параметрами или на IVFFlat — POST /admin/ann-index/rebuild
 CREATE INDEX IF NOT EXISTS rag_vacancies_embedding_idx ON public.rag_vacancies
-USING ivfflat (embedding vector_cosine_ops)
-WITH (lists = 100);
+USING hnsw (embedding vector_cosine_ops)
+WITH (m = 16, ef_construction = 64);
+-- Полнотекстовая часть гибридного поиска: GIN по search_tsv
+CREATE INDEX IF NOT EXISTS rag_vacancies_search_tsv_idx ON public.rag_vacancies USING gin (search_tsv);
+-- Фильтры поиска /search и /rag: B-tree индексы по колонкам фильтров
+CREATE INDEX IF NOT EXISTS rag_vacancies_area_name_idx ON public.rag_vacancies(area_name);
+CREATE INDEX IF NOT EXISTS rag_vacancies_employer_name_idx ON public.rag_vacancies(employer_name);
+CREATE INDEX IF NOT EXISTS rag_vacancies_published_at_idx ON public.rag_vacancies(published_at);
+CREATE INDEX IF NOT EXISTS rag_vacancies_salary_from_idx ON public.rag_vacancies(salary_from);
+CREATE INDEX IF NOT EXISTS rag_vacancies_salary_to_idx ON public.rag_vacancies(salary_to);
 COMMENT ON TABLE public.rag_vacancies IS 'Вакансии с эмбеддингами для RAG; заполняется из raw_vacancies';
 
 -- Навыки по вакансиям (из raw_vacancies.raw_json.key_skills)
@@ -43,3 +64,71 @@ CREATE TABLE IF NOT EXISTS public.vacancy_skills (
 );
 CREATE INDEX IF NOT EXISTS vacancy_skills_skill_id_idx ON public.vacancy_skills(skill_id);
 COMMENT ON TABLE public.vacancy_skills IS 'Связь вакансия — навык (многие ко многим)';
+
+CREATE TABLE IF NOT EXISTS public.vacancy_skills_state (
+    hh_id VARCHAR(32) PRIMARY KEY REFERENCES public.raw_vacancies(hh_id) ON DELETE CASCADE,
+    content_hash VARCHAR(32) NOT NULL,
+    processed_at TIMESTAMPTZ DEFAULT NOW()
+);
+COMMENT ON TABLE public.vacancy_skills_state IS 'md5(name, description, key_skills) на момент сбора навыков; при совпадении collect_skills_from_raw пропускает вакансию';
+
+-- Снимок статистики дашборда (GET /stats)
+CREATE TABLE IF NOT EXISTS public.stats_snapshot (
+    id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    data JSONB NOT NULL,
+    computed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+COMMENT ON TABLE public.stats_snapshot IS 'Одна строка: агрегаты get_stats и время расчёта; GET /stats?fresh=1 пересчитывает';
+
+-- Фоновые задачи массовой выгрузки (этап 1) с чекпоинтами
+CREATE TABLE IF NOT EXISTS public.ingest_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+    params JSONB NOT NULL,
+    search_cursor JSONB NOT NULL DEFAULT '{}'::jsonb,
+    error TEXT,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+COMMENT ON TABLE public.ingest_jobs IS 'Задачи выгрузки: pending → searching → fetching → done | failed; search_cursor — {query_index, page}';
+
+CREATE TABLE IF NOT EXISTS public.ingest_job_items (
+    job_id BIGINT NOT NULL REFERENCES public.ingest_jobs(id) ON DELETE CASCADE,
+    hh_id VARCHAR(32) NOT NULL,
+    position INTEGER NOT NULL,
+    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+    PRIMARY KEY (job_id, hh_id)
+);
+CREATE INDEX IF NOT EXISTS ingest_job_items_pending_idx ON public.ingest_job_items(job_id, position)
+WHERE status = 'pending';
+COMMENT ON TABLE public.ingest_job_items IS 'План задачи выгрузки: hh_id и статус (pending | done | skipped | failed)';
+
+-- Предрасчитанная статистика навыков (REFRESH ... CONCURRENTLY после сбора навыков)
+CREATE MATERIALIZED VIEW IF NOT EXISTS public.skill_counts_mv AS
+SELECT s.id AS skill_id, s.name, COUNT(vs.hh_id) AS vacancy_count
+FROM public.skills s
+LEFT JOIN public.vacancy_skills vs ON vs.skill_id = s.id
+GROUP BY s.id, s.name;
+CREATE UNIQUE INDEX IF NOT EXISTS skill_counts_mv_skill_id_idx ON public.skill_counts_mv(skill_id);
+CREATE INDEX IF NOT EXISTS skill_counts_mv_top_idx ON public.skill_counts_mv(vacancy_count DESC, name);
+COMMENT ON MATERIALIZED VIEW public.skill_counts_mv IS 'Навык — число вакансий (GET /skills)';
+
+-- Пары навыков, встречающихся в одной вакансии (в обе стороны: skill_id → other_skill_id)
+CREATE MATERIALIZED VIEW IF NOT EXISTS public.skill_cooccurrence_mv AS
+SELECT a.skill_id, b.skill_id AS other_skill_id, COUNT(*) AS vacancy_count
+FROM public.vacancy_skills a
+JOIN public.vacancy_skills b ON b.hh_id = a.hh_id AND b.skill_id <> a.skill_id
+GROUP BY a.skill_id, b.skill_id;
+CREATE UNIQUE INDEX IF NOT EXISTS skill_cooccurrence_mv_pair_idx ON public.skill_cooccurrence_mv(skill_id, other_skill_id);
+CREATE INDEX IF NOT EXISTS skill_cooccurrence_mv_top_idx ON public.skill_cooccurrence_mv(skill_id, vacancy_count DESC);
+COMMENT ON MATERIALIZED VIEW public.skill_cooccurrence_mv IS 'Совместная встречаемость навыков (GET /skills/cooccurrence)';
+
+-- Навык по регионам (регион — из rag_vacancies, то есть по вакансиям, прошедшим этап 2)
+CREATE MATERIALIZED VIEW IF NOT EXISTS public.skill_areas_mv AS
+SELECT vs.skill_id, COALESCE(r.area_name, '') AS area_name, COUNT(*) AS vacancy_count
+FROM public.vacancy_skills vs
+JOIN public.rag_vacancies r ON r.hh_id = vs.hh_id
+GROUP BY vs.skill_id, COALESCE(r.area_name, '');
+CREATE UNIQUE INDEX IF NOT EXISTS skill_areas_mv_key_idx ON public.skill_areas_mv(skill_id, area_name);
+CREATE INDEX IF NOT EXISTS skill_areas_mv_top_idx ON public.skill_areas_mv(skill_id, vacancy_count DESC);
+COMMENT ON MATERIALIZED VIEW public.skill_areas_mv IS 'Навык — регион — число вакансий (GET /skills/areas)';
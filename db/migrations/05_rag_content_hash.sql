@@ -0,0 +1,3 @@
+-- Инкрементальный этап 2: хэш содержимого, по которому построен эмбеддинг вакансии
+ALTER TABLE public.rag_vacancies ADD COLUMN IF NOT EXISTS content_hash VARCHAR(40);
+COMMENT ON COLUMN public.rag_vacancies.content_hash IS 'sha1 (модель + текст для эмбеддинга + поля); при совпадении process_raw_to_rag пропускает вакансию';
@@ -0,0 +1,22 @@
+-- Фоновые задачи массовой выгрузки (этап 1) с чекпоинтами: POST /ingest/jobs, GET /ingest/jobs/{id}
+CREATE TABLE IF NOT EXISTS public.ingest_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+    params JSONB NOT NULL,
+    search_cursor JSONB NOT NULL DEFAULT '{}'::jsonb,
+    error TEXT,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    updated_at TIMESTAMPTZ DEFAULT NOW()
+);
+COMMENT ON TABLE public.ingest_jobs IS 'Задачи выгрузки: pending → searching → fetching → done | failed; search_cursor — {query_index, page}';
+
+CREATE TABLE IF NOT EXISTS public.ingest_job_items (
+    job_id BIGINT NOT NULL REFERENCES public.ingest_jobs(id) ON DELETE CASCADE,
+    hh_id VARCHAR(32) NOT NULL,
+    position INTEGER NOT NULL,
+    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+    PRIMARY KEY (job_id, hh_id)
+);
+CREATE INDEX IF NOT EXISTS ingest_job_items_pending_idx ON public.ingest_job_items(job_id, position)
+WHERE status = 'pending';
+COMMENT ON TABLE public.ingest_job_items IS 'План задачи выгрузки: hh_id и статус (pending | done | skipped | failed)';
@@ -0,0 +1,7 @@
+-- Инкрементальный сбор навыков: хэш полей вакансии, по которым построены её связи в vacancy_skills
+CREATE TABLE IF NOT EXISTS public.vacancy_skills_state (
+    hh_id VARCHAR(32) PRIMARY KEY REFERENCES public.raw_vacancies(hh_id) ON DELETE CASCADE,
+    content_hash VARCHAR(32) NOT NULL,
+    processed_at TIMESTAMPTZ DEFAULT NOW()
+);
+COMMENT ON TABLE public.vacancy_skills_state IS 'md5(name, description, key_skills) на момент сбора навыков; при совпадении collect_skills_from_raw пропускает вакансию';
@@ -0,0 +1,30 @@
+-- Предрасчитанная статистика навыков для GET /skills; обновляется REFRESH ... CONCURRENTLY
+-- после collect_skills_from_raw (для CONCURRENTLY нужен уникальный индекс)
+CREATE MATERIALIZED VIEW IF NOT EXISTS public.skill_counts_mv AS
+SELECT s.id AS skill_id, s.name, COUNT(vs.hh_id) AS vacancy_count
+FROM public.skills s
+LEFT JOIN public.vacancy_skills vs ON vs.skill_id = s.id
+GROUP BY s.id, s.name;
+CREATE UNIQUE INDEX IF NOT EXISTS skill_counts_mv_skill_id_idx ON public.skill_counts_mv(skill_id);
+CREATE INDEX IF NOT EXISTS skill_counts_mv_top_idx ON public.skill_counts_mv(vacancy_count DESC, name);
+COMMENT ON MATERIALIZED VIEW public.skill_counts_mv IS 'Навык — число вакансий (GET /skills)';
+
+-- Пары навыков, встречающихся в одной вакансии (в обе стороны: skill_id → other_skill_id)
+CREATE MATERIALIZED VIEW IF NOT EXISTS public.skill_cooccurrence_mv AS
+SELECT a.skill_id, b.skill_id AS other_skill_id, COUNT(*) AS vacancy_count
+FROM public.vacancy_skills a
+JOIN public.vacancy_skills b ON b.hh_id = a.hh_id AND b.skill_id <> a.skill_id
+GROUP BY a.skill_id, b.skill_id;
+CREATE UNIQUE INDEX IF NOT EXISTS skill_cooccurrence_mv_pair_idx ON public.skill_cooccurrence_mv(skill_id, other_skill_id);
+CREATE INDEX IF NOT EXISTS skill_cooccurrence_mv_top_idx ON public.skill_cooccurrence_mv(skill_id, vacancy_count DESC);
+COMMENT ON MATERIALIZED VIEW public.skill_cooccurrence_mv IS 'Совместная встречаемость навыков (GET /skills/cooccurrence)';
+
+-- Навык по регионам (регион — из rag_vacancies, то есть по вакансиям, прошедшим этап 2)
+CREATE MATERIALIZED VIEW IF NOT EXISTS public.skill_areas_mv AS
+SELECT vs.skill_id, COALESCE(r.area_name, '') AS area_name, COUNT(*) AS vacancy_count
+FROM public.vacancy_skills vs
+JOIN public.rag_vacancies r ON r.hh_id = vs.hh_id
+GROUP BY vs.skill_id, COALESCE(r.area_name, '');
+CREATE UNIQUE INDEX IF NOT EXISTS skill_areas_mv_key_idx ON public.skill_areas_mv(skill_id, area_name);
+CREATE INDEX IF NOT EXISTS skill_areas_mv_top_idx ON public.skill_areas_mv(skill_id, vacancy_count DESC);
+COMMENT ON MATERIALIZED VIEW public.skill_areas_mv IS 'Навык — регион — число вакансий (GET /skills/areas)';
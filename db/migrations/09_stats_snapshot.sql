@@ -0,0 +1,7 @@
+-- Снимок статистики дашборда (GET /stats): пересчитывается после загрузки на этапах 1 и 2
+CREATE TABLE IF NOT EXISTS public.stats_snapshot (
+    id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    data JSONB NOT NULL,
+    computed_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+COMMENT ON TABLE public.stats_snapshot IS 'Одна строка: агрегаты get_stats и время расчёта; GET /stats?fresh=1 пересчитывает';
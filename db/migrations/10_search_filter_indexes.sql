@@ -0,0 +1,6 @@
+-- Фильтры поиска /search и /rag: B-tree индексы по колонкам фильтров
+CREATE INDEX IF NOT EXISTS rag_vacancies_area_name_idx ON public.rag_vacancies(area_name);
+CREATE INDEX IF NOT EXISTS rag_vacancies_employer_name_idx ON public.rag_vacancies(employer_name);
+CREATE INDEX IF NOT EXISTS rag_vacancies_published_at_idx ON public.rag_vacancies(published_at);
+CREATE INDEX IF NOT EXISTS rag_vacancies_salary_from_idx ON public.rag_vacancies(salary_from);
+CREATE INDEX IF NOT EXISTS rag_vacancies_salary_to_idx ON public.rag_vacancies(salary_to);
@@ -0,0 +1,14 @@
+-- Гибридный поиск (mode=hybrid): навыки вакансии и полнотекстовый индекс (russian + english)
+-- key_skills заполняется на этапе 2; content_hash меняется, поэтому следующий POST /ingest/embed
+-- перезапишет все вакансии (и пересчитает эмбеддинги)
+ALTER TABLE public.rag_vacancies ADD COLUMN IF NOT EXISTS key_skills TEXT;
+ALTER TABLE public.rag_vacancies ADD COLUMN IF NOT EXISTS search_tsv tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('russian', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('russian', coalesce(key_skills, '')), 'B') ||
+    setweight(to_tsvector('english', coalesce(key_skills, '')), 'B') ||
+    setweight(to_tsvector('russian', coalesce(description, '')), 'C') ||
+    setweight(to_tsvector('english', coalesce(description, '')), 'C')
+) STORED;
+CREATE INDEX IF NOT EXISTS rag_vacancies_search_tsv_idx ON public.rag_vacancies USING gin (search_tsv);
+COMMENT ON COLUMN public.rag_vacancies.search_tsv IS 'Полнотекстовый вектор: название (A), навыки (B), описание (C); russian + english';
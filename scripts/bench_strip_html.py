@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк очистки описаний вакансий от HTML: прежняя strip_html (13 str.replace,
+регулярное выражение, split/join) против текущей app.hh_client.strip_html.
+Описания берутся из raw_vacancies (реальные ответы hh.ru), без БД — встроенный пример.
+Печатает время одного вызова на описание и ускорение. Текущая версия за один проход делит
+HTML по угловым скобкам и заменяет теги поиском в словаре, хотя дополнительно раскодирует
+HTML-сущности и сохраняет границы абзацев и списков. Без БД замер идёт на коротком примере
+и на описании типичной для hh.ru длины. Отдельной строкой — стоимость очистки на вакансию
+этапа 2: раньше описание очищалось дважды (колонка description и vacancy_to_text), теперь — один раз.
+
+Пример:
+  python scripts/bench_strip_html.py
+  python scripts/bench_strip_html.py --from-db 2000 --repeat 7
+  python scripts/bench_strip_html.py --no-db
+"""
+import argparse
+import re
+import sys
+import timeit
+
+# чтобы импортировать app при запуске из корня проекта
+sys.path.insert(0, ".")
+
+# Описание в типичной для hh.ru разметке (если БД недоступна)
+FIXTURE_HTML = (
+    "<p><strong>Обязанности:</strong></p><ul><li>Разработка ETL/ELT-пайплайнов на Python&nbsp;3 и Airflow</li>"
+    "<li>Поддержка DWH (Greenplum, ClickHouse), оптимизация запросов</li><li>Интеграция источников &quot;1С&quot; и CRM</li></ul>"
+    "<p><strong>Требования:</strong></p><ul><li>SQL, Python, опыт от 2 лет</li><li>Spark, Kafka &mdash; плюс</li></ul>"
+    "<p><strong>Условия:</strong></p><ul><li>Удалённая работа или офис в Москве</li><li>ДМС, обучение за счёт компании</li></ul>"
+)
+
+
+def legacy_strip_html(html: str | None) -> str | None:
+    """Прежняя strip_html (для сравнения)."""
+    if not html or not html.strip():
+        return None
+    text = html
+    for tag in ("<p>", "</p>", "<br>", "<br/>", "<br />", "<ul>", "</ul>", "<li>", "</li>", "<strong>", "</strong>", "<div>", "</div>"):
+        text = text.replace(tag, " ")
+    text = re.sub(r"<[^>]+>", " ", text)
+    text = " ".join(text.split())
+    return text.strip() or None
+
+
+def _descriptions_from_db(limit: int) -> list[str]:
+    from app.db import get_connection
+
+    with get_connection() as conn:
+        cur = conn.execute(
+            "SELECT raw_json->>'description' FROM public.raw_vacancies "
+            "WHERE raw_json ? 'description' ORDER BY hh_id LIMIT %s",
+            (limit,),
+        )
+        return [r[0] for r in cur.fetchall() if r[0]]
+
+
+def _per_item_us(fn, items: list[str], calls: int, repeat: int) -> float:
+    def run() -> None:
+        for html in items:
+            for _ in range(calls):
+                fn(html)
+
+    best = min(timeit.repeat(run, number=1, repeat=repeat))
+    return best / len(items) * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Сравнение прежней и текущей strip_html")
+    parser.add_argument("--from-db", type=int, default=1000, metavar="N", help="Взять N описаний из raw_vacancies")
+    parser.add_argument("--no-db", action="store_true", help="Не обращаться к БД, взять встроенный пример")
+    parser.add_argument("--repeat", type=int, default=5, help="Повторов замера (берётся лучший)")
+    args = parser.parse_args()
+
+    from app.hh_client import strip_html
+
+    items: list[str] = []
+    if not args.no_db:
+        try:
+            items = _descriptions_from_db(args.from_db)
+        except Exception as e:
+            print(f"БД недоступна ({e}), используется встроенный пример")
+    samples = [(items, "raw_vacancies")]
+    if not items:
+        samples = [
+            ([FIXTURE_HTML] * 1000, "встроенный пример"),
+            ([FIXTURE_HTML * 6] * 200, "встроенный пример x6"),
+        ]
+
+    for descriptions, source in samples:
+        avg_len = sum(len(h) for h in descriptions) // len(descriptions)
+        print(f"Описаний: {len(descriptions)} ({source}), средняя длина {avg_len} символов")
+        old_call = _per_item_us(legacy_strip_html, descriptions, 1, args.repeat)
+        new_call = _per_item_us(strip_html, descriptions, 1, args.repeat)
+        old_vacancy = _per_item_us(legacy_strip_html, descriptions, 2, args.repeat)
+        print(f"  Один вызов:  прежняя {old_call:8.1f} мкс, текущая {new_call:8.1f} мкс (ускорение x{old_call / new_call:.2f})")
+        print(f"  Очистка на вакансию этапа 2 (прежде 2 вызова, теперь 1): {old_vacancy:.1f} -> {new_call:.1f} мкс")
+    sample = strip_html(samples[0][0][0]) or ""
+    print("Пример результата:")
+    for line in sample.splitlines()[:5]:
+        print(f"  {line[:100]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Сверка бэкендов эмбеддингов: torch (эталон) против onnx / onnx int8.
+Считает косинусную близость векторов одних и тех же текстов и время encode.
+Код выхода 1, если минимальная близость ниже порога.
+
+Пример:
+  python scripts/check_embedding_parity.py
+  python scripts/check_embedding_parity.py --quantization avx512_vnni
+  python scripts/check_embedding_parity.py --quantization avx2 --from-db 500 --threshold 0.98
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+# чтобы импортировать app при запуске из корня проекта
+sys.path.insert(0, ".")
+
+# Набор текстов по умолчанию: типичные вакансии, русский и английский, короткие и длинные
+FIXTURE_TEXTS = [
+    "Data Engineer",
+    "Python-разработчик (Django, PostgreSQL)",
+    "Senior Data Engineer. Навыки: Python, SQL, Apache Spark, Airflow, Kafka",
+    "Дата инженер в команду DWH. Работодатель: Сбер. Регион: Москва. Навыки: Greenplum, dbt, Airflow",
+    "Аналитик данных. Требования: SQL, Power BI, Excel, опыт от 2 лет. Удалённая работа.",
+    "ML Engineer (NLP). We build search and recommendation systems with PyTorch and Kubernetes.",
+    "Разработчик ClickHouse. Оптимизация запросов, партиционирование, materialized views.",
+    "Инженер данных. Обязанности: построение ETL/ELT-пайплайнов, интеграция источников, контроль "
+    "качества данных. Требования: Python, SQL, Hadoop, Hive, Spark, опыт работы с Kafka и CDC (Debezium).",
+    "Backend developer Go / Golang, микросервисы, gRPC, PostgreSQL, Redis, Docker, CI/CD.",
+    "Ведущий инженер по данным. Работодатель: Яндекс. Регион: Санкт-Петербург. "
+    "Навыки: YTsaurus, ClickHouse, Python, C++. Описание: разработка платформы данных.",
+    "удалённая работа python",
+    "вакансии с высокой зарплатой в Казани",
+]
+
+
+def _texts_from_db(limit: int) -> list[str]:
+    from app.db import get_connection
+    from app.hh_client import vacancy_to_text
+
+    with get_connection() as conn:
+        cur = conn.execute("SELECT raw_json FROM public.raw_vacancies ORDER BY hh_id LIMIT %s", (limit,))
+        return [vacancy_to_text(r[0]) for r in cur.fetchall()]
+
+
+def _encode(model, texts: list[str], batch_size: int) -> tuple[np.ndarray, float]:
+    model.encode(texts[:batch_size], batch_size=batch_size)  # прогрев
+    started = time.perf_counter()
+    vecs = model.encode(texts, batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True)
+    return vecs, time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Косинусная сверка эмбеддингов torch и onnx")
+    parser.add_argument(
+        "--quantization",
+        default=None,
+        help="int8-квантизация onnx: avx2, avx512, avx512_vnni, arm64 (по умолчанию — EMBEDDING_ONNX_QUANTIZATION)",
+    )
+    parser.add_argument("--threshold", type=float, default=0.99, help="Мин. косинусная близость (по умолчанию 0.99)")
+    parser.add_argument("--from-db", type=int, default=0, metavar="N", help="Взять N текстов из raw_vacancies")
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    from app.config import settings
+    from app.embeddings import load_embedding_model
+
+    quantization = args.quantization or settings.embedding_onnx_quantization
+    texts = _texts_from_db(args.from_db) if args.from_db else FIXTURE_TEXTS
+    if not texts:
+        print("Нет текстов для сверки")
+        sys.exit(1)
+
+    reference, torch_sec = _encode(load_embedding_model("torch"), texts, args.batch_size)
+    candidate, onnx_sec = _encode(load_embedding_model("onnx", quantization), texts, args.batch_size)
+    cosine = np.sum(reference * candidate, axis=1)
+
+    label = f"onnx ({'int8 ' + quantization if quantization else 'fp32'})"
+    print(f"Текстов: {len(texts)}")
+    print(f"torch: {torch_sec:.3f} с, {label}: {onnx_sec:.3f} с, ускорение x{torch_sec / onnx_sec:.2f}")
+    print(f"Косинус: min {cosine.min():.5f}, mean {cosine.mean():.5f}, порог {args.threshold}")
+    worst = np.argsort(cosine)[:3]
+    for i in worst:
+        print(f"  {cosine[i]:.5f}  {texts[i][:80]}")
+    if cosine.min() < args.threshold:
+        print("FAIL: расхождение с torch выше допустимого")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
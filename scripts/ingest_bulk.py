@@ -7,6 +7,8 @@
   python scripts/ingest_bulk.py
   python scripts/ingest_bulk.py --target 500
   python scripts/ingest_bulk.py --queries "data engineer" "dwh"
+  python scripts/ingest_bulk.py --job --target 5000   # задача с чекпоинтами в БД
+  python scripts/ingest_bulk.py --resume 12           # продолжить задачу после обрыва
 """
 import argparse
 import sys
@@ -32,8 +34,8 @@ def main() -> None:
     parser.add_argument(
         "--delay",
         type=float,
-        default=1.2,
-        help="Пауза между запросами деталей к API hh.ru в секундах (по умолчанию 1.2)",
+        default=None,
+        help="Мин. пауза между запросами деталей к API hh.ru в секундах (по умолчанию — по лимитам HH_*_RPS)",
     )
     parser.add_argument(
         "--chunk-size",
@@ -42,14 +44,46 @@ def main() -> None:
         metavar="N",
         help="Размер порции: загрузить N вакансий → эмбеддинги → БД, затем следующая порция (по умолчанию 100)",
     )
+    parser.add_argument(
+        "--job",
+        action="store_true",
+        help="Выгрузка как задача с чекпоинтами в БД (public.ingest_jobs): после обрыва продолжается через --resume",
+    )
+    parser.add_argument(
+        "--resume",
+        type=int,
+        default=None,
+        metavar="JOB_ID",
+        help="Продолжить задачу выгрузки с сохранённого чекпоинта",
+    )
     args = parser.parse_args()
 
     from app.vacancies import DEFAULT_DATA_ENGINEER_QUERIES, load_and_index_vacancies_multi
 
+    if args.job or args.resume is not None:
+        from app.jobs import create_ingest_job, get_ingest_job, resume_ingest_job, run_ingest_job
+
+        job_id = args.resume
+        if job_id is None:
+            job_id = create_ingest_job(
+                search_queries=args.queries,
+                target_count=args.target,
+                chunk_size=args.chunk_size,
+                detail_delay_sec=args.delay,
+            )
+            print(f"Создана задача выгрузки: {job_id}")
+        else:
+            resume_ingest_job(job_id)
+        if not run_ingest_job(job_id):
+            print(f"Задача {job_id} не активна или уже выполняется другим процессом")
+        job = get_ingest_job(job_id)
+        print(f"Задача {job_id}: {job['status'] if job else 'не найдена'}, id по статусам: {job['items'] if job else {}}")
+        return
+
     queries = args.queries or DEFAULT_DATA_ENGINEER_QUERIES
     print(f"Запросы: {queries}")
-    print(f"Цель: {args.target} вакансий, чанк: {args.chunk_size}, задержка: {args.delay} с")
-    print("Загрузка может занять 20–40 минут из-за лимитов API hh.ru...")
+    print(f"Цель: {args.target} вакансий, чанк: {args.chunk_size}, задержка: {args.delay or 'по лимитам'}")
+    print("Скорость загрузки деталей ограничена лимитами API hh.ru (HH_ANON_RPS / HH_OAUTH_RPS)...")
 
     n = load_and_index_vacancies_multi(
         search_queries=queries,
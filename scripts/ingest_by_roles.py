@@ -38,7 +38,7 @@ if CONFIG_PATH.exists():
 def main() -> None:
     import argparse
     from app.hh_client import fetch_professional_roles, fetch_vacancies_by_role
-    from app.vacancies import load_and_index_vacancy_ids
+    from app.vacancies import filter_new_or_changed, load_and_index_vacancy_ids
 
     parser = argparse.ArgumentParser(
         description="Загрузка вакансий по профессиональным ролям (Москва) в RAG"
@@ -82,8 +82,8 @@ def main() -> None:
     parser.add_argument(
         "--detail-delay",
         type=float,
-        default=1.2,
-        help="Пауза между запросами деталей вакансии (сек)",
+        default=None,
+        help="Мин. пауза между запросами деталей вакансии (сек); по умолчанию — по лимитам HH_*_RPS",
     )
     args = parser.parse_args()
 
@@ -101,6 +101,7 @@ def main() -> None:
 
     seen_ids: set[str] = set()
     all_ids: list[str] = []
+    all_items: list[dict] = []
 
     for role in roles:
         if len(all_ids) >= args.target:
@@ -123,6 +124,7 @@ def main() -> None:
             if vid and vid not in seen_ids:
                 seen_ids.add(vid)
                 all_ids.append(vid)
+                all_items.append(it)
                 added += 1
         print(f"+{added} вакансий (всего {len(all_ids)})")
 
@@ -131,11 +133,18 @@ def main() -> None:
         print("Нет вакансий для индексации.")
         return
 
+    # Delta: детали только для новых и изменившихся (published_at/updated_at в выдаче поиска)
+    to_index = filter_new_or_changed(all_items[: args.target])
+    print(f"Новых или изменившихся: {len(to_index)} из {len(all_ids[: args.target])}")
+    if not to_index:
+        return
+
     print(f"\nИндексация {len(to_index)} вакансий (чанки по {args.chunk_size})...")
     n = load_and_index_vacancy_ids(
         to_index,
         chunk_size=args.chunk_size,
         detail_delay_sec=args.detail_delay,
+        skip_existing=False,
     )
     print(f"Проиндексировано: {n}")
 